@@ -0,0 +1,140 @@
+import math
+import threading
+import time
+from flask import g, jsonify, request
+from config import Config
+
+EXEMPT = 'exempt'
+LIGHT = 'light'
+NORMAL = 'normal'
+HEAVY = 'heavy'
+
+# Never queued or shed: the health probe and long-lived event streams, which hold no connection while idle
+EXEMPT_ENDPOINTS = {'health_check', 'events.stream_events'}
+# Cheap catalog reads keep the connections reserved for them during a burst
+LIGHT_ENDPOINTS = {
+    'products.get_product_categories', 'products.get_products', 'products.get_product',
+    'products.get_products_batch', 'products.get_products_by_category', 'measurements.get_measurement_types',
+}
+# Large scans and exports are the first to be shed
+HEAVY_ENDPOINTS = {
+    'orders.list_orders', 'measurements.get_all_measurements', 'measurements.get_org_measurements',
+    'measurements.get_size_analytics', 'users.get_all_org_users', 'reports.get_measurement_sheets',
+    'stats.reconcile_org_stats', 'products.get_size_recommendations',
+}
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        # Returns 0 when a token was taken, otherwise the seconds until one is available
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+class ClientLimiter:
+    def __init__(self, rate=Config.CLIENT_RATE_PER_SECOND, burst=Config.CLIENT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, client):
+        with self.lock:
+            bucket = self.buckets.get(client)
+            if bucket is None:
+                if len(self.buckets) > 10000:
+                    self._prune()
+                bucket = self.buckets[client] = TokenBucket(self.rate, self.burst)
+            return bucket.take()
+
+    def _prune(self):
+        # A bucket idle long enough to have refilled is the same as a new one
+        idle = self.burst / self.rate
+        now = time.monotonic()
+        self.buckets = {client: bucket for client, bucket in self.buckets.items() if now - bucket.updated < idle}
+
+# Caps the requests working against MySQL at once. Light routes may use every slot; the rest
+# leave ADMISSION_RESERVED_FOR_LIGHT free, and heavy routes have their own smaller cap.
+class AdmissionGate:
+    def __init__(self, capacity=Config.ADMISSION_CAPACITY, reserved=Config.ADMISSION_RESERVED_FOR_LIGHT,
+                 heavy_limit=Config.ADMISSION_HEAVY_LIMIT):
+        self.limits = {LIGHT: capacity, NORMAL: capacity - reserved, HEAVY: min(heavy_limit, capacity - reserved)}
+        self.in_flight = 0
+        self.heavy_in_flight = 0
+        self.condition = threading.Condition()
+
+    def _has_room(self, route_class):
+        if route_class == HEAVY and self.heavy_in_flight >= self.limits[HEAVY]:
+            return False
+        return self.in_flight < self.limits[route_class]
+
+    def acquire(self, route_class, timeout):
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while not self._has_room(route_class):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+            self.in_flight += 1
+            if route_class == HEAVY:
+                self.heavy_in_flight += 1
+            return True
+
+    def release(self, route_class):
+        with self.condition:
+            self.in_flight -= 1
+            if route_class == HEAVY:
+                self.heavy_in_flight -= 1
+            self.condition.notify_all()
+
+def route_class(endpoint):
+    if endpoint is None or endpoint in EXEMPT_ENDPOINTS:
+        return EXEMPT
+    if endpoint in LIGHT_ENDPOINTS:
+        return LIGHT
+    if endpoint in HEAVY_ENDPOINTS:
+        return HEAVY
+    return NORMAL
+
+def _reject(status, message, retry_after):
+    response = jsonify({'success': False, 'message': message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+def init_admission(app):
+    gate = AdmissionGate()
+    limiter = ClientLimiter()
+
+    @app.before_request
+    def admit():
+        current = route_class(request.endpoint)
+        if current == EXEMPT or request.method == 'OPTIONS':
+            return None
+
+        # Keyed on the client address, which ProxyFix takes from a trusted X-Forwarded-For. The org in a URL
+        # is not authenticated, so a bucket shared per org would let anyone exhaust another org's budget
+        retry_after = limiter.take(request.remote_addr)
+        if retry_after:
+            return _reject(429, 'Too many requests', retry_after)
+
+        if not gate.acquire(current, Config.ADMISSION_WAIT_SECONDS[current]):
+            return _reject(503, 'Server is busy, please retry', Config.ADMISSION_RETRY_AFTER_SECONDS)
+        g.admitted_class = current
+        return None
+
+    @app.teardown_request
+    def release(exc):
+        admitted = g.pop('admitted_class', None)
+        if admitted is not None:
+            gate.release(admitted)
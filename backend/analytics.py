@@ -0,0 +1,61 @@
+import numpy as np
+from db import execute_query
+
+DEFAULT_PERCENTILES = [5, 25, 50, 75, 95]
+
+# Numeric values of each org user's latest measurement of one type, shared by the size run and recommendations
+LATEST_VALUES_QUERY = """
+    SELECT m.user_id, mv.measurement_id, mv.field_id, mv.value_numeric
+    FROM measurements m
+    JOIN org_users ou ON m.user_id = ou.id
+    JOIN (
+        SELECT user_id, MAX(created_at) AS latest
+        FROM measurements
+        WHERE measurement_type_id = %s AND user_type = 'org_user'
+        GROUP BY user_id
+    ) lm ON lm.user_id = m.user_id AND lm.latest = m.created_at
+    JOIN measurement_values mv ON mv.measurement_id = m.id
+    WHERE ou.org_id = %s AND m.measurement_type_id = %s AND m.user_type = 'org_user'
+      AND mv.value_numeric IS NOT NULL
+"""
+
+def latest_measurement_values(org_id, type_id):
+    return execute_query(LATEST_VALUES_QUERY, (type_id, org_id, type_id))
+
+def size_distribution(field_ids, measurement_ids, values, percentiles=DEFAULT_PERCENTILES, bins=10):
+    field_ids = np.asarray(field_ids)
+    measurement_ids = np.asarray(measurement_ids)
+    values = np.asarray(values, dtype=np.float64)
+    if values.size == 0:
+        return {}
+
+    # One sort groups every field into a contiguous slice
+    fields, inverse = np.unique(field_ids, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.searchsorted(inverse[order], np.arange(len(fields) + 1))
+
+    result = {}
+    for index, field_id in enumerate(fields):
+        selection = order[bounds[index]:bounds[index + 1]]
+        field_values = values[selection]
+        q1, q3 = np.percentile(field_values, [25, 75])
+        iqr = q3 - q1
+        outliers = (field_values < q1 - 1.5 * iqr) | (field_values > q3 + 1.5 * iqr)
+        counts, edges = np.histogram(field_values, bins=bins)
+        result[str(field_id)] = {
+            'count': int(field_values.size),
+            'mean': round(float(field_values.mean()), 3),
+            'std': round(float(field_values.std()), 3),
+            'min': round(float(field_values.min()), 3),
+            'max': round(float(field_values.max()), 3),
+            'percentiles': {
+                f"{p:g}": round(float(v), 3)
+                for p, v in zip(percentiles, np.percentile(field_values, percentiles))
+            },
+            'histogram': {
+                'counts': counts.tolist(),
+                'edges': [round(float(edge), 3) for edge in edges]
+            },
+            'outliers': measurement_ids[selection][outliers].tolist()
+        }
+    return result
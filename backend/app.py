@@ -1,37 +1,94 @@
 import os
+import time
 import logging
-from flask import Flask, jsonify
+from flask import Flask, jsonify, request, g
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 from config import Config
-from db import create_db_if_not_exists
+from db import create_db_if_not_exists, StatementTimeout, remember_write, LAST_WRITE_HEADER
 from init_db import create_tables
+from jobs import start_job_runner
+from structured_logging import setup_logging
+from admission import init_admission
+from profiler import init_profiling
 
 from blueprints.auth import auth
 from blueprints.users import users
 from blueprints.measurements import measurements
 from blueprints.products import products
 from blueprints.orders import orders_bp
+from blueprints.events import events
+from blueprints.stats import stats
+from blueprints.jobs import jobs_bp
+from blueprints.reports import reports
+from blueprints.profiling import profiling
 
-if not os.path.exists('logs'):
-    os.makedirs('logs')
+access_log = logging.getLogger('access')
 
-logging.basicConfig(
-    filename=Config.LOG_FILE,
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-
-def create_app():
+def create_app(start_jobs=True, configure_logging=True):
     app = Flask(__name__)
     app.config.from_object(Config)
+    if Config.TRUSTED_PROXY_COUNT:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=Config.TRUSTED_PROXY_COUNT)
+
+    # Web-only processes that leave the jobs to another one still log
+    if configure_logging:
+        setup_logging()
     
-    CORS(app, resources={r"/*": {"origins": "*"}})
+    CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=[LAST_WRITE_HEADER])
 
     app.register_blueprint(auth)
     app.register_blueprint(users)
     app.register_blueprint(measurements)
     app.register_blueprint(products)
     app.register_blueprint(orders_bp)
+    app.register_blueprint(events)
+    app.register_blueprint(stats)
+    app.register_blueprint(jobs_bp)
+    app.register_blueprint(reports)
+    app.register_blueprint(profiling)
+    
+    if start_jobs:
+        start_job_runner()
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        g.db_queries = 0
+
+    app.after_request(remember_write)
+
+    # Registered after the timer so shed requests still show up in the access log
+    init_admission(app)
+    init_profiling(app)
+
+    @app.after_request
+    def log_request(response):
+        access_log.info('request', extra={
+            'method': request.method,
+            'route': request.url_rule.rule if request.url_rule else None,
+            'path': request.path,
+            'status': response.status_code,
+            'latency_ms': round((time.perf_counter() - g.get('request_started', time.perf_counter())) * 1000, 2),
+            'db_queries': g.get('db_queries', 0),
+        })
+        return response
+
+    def statement_timeout_response():
+        response = jsonify({'success': False, 'message': 'The request took too long to process'})
+        response.status_code = 504
+        return response
+
+    @app.after_request
+    def map_statement_timeout(response):
+        # Routes catch their own errors, so a statement that ran past its deadline surfaces here as a 500
+        if g.get('statement_timeout') and response.status_code >= 500:
+            return statement_timeout_response()
+        return response
+
+    @app.errorhandler(StatementTimeout)
+    def statement_timeout(error):
+        return statement_timeout_response()
     
     @app.errorhandler(404)
     def not_found(error):
@@ -53,7 +110,9 @@ if __name__ == '__main__':
         create_db_if_not_exists()
         create_tables()
         
-        app = create_app()
+        # Under the reloader only the serving child process runs the job workers and owns the log file
+        serving = os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+        app = create_app(start_jobs=serving, configure_logging=serving)
         app.run(debug=True, host='0.0.0.0', port=5000)
     except Exception as e:
         print(f"Error starting application: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,252 @@
+import gzip
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+from config import Config
+from db import get_connection, execute_query
+import jobs
+import org_stats
+
+# Completed orders and superseded measurements older than the cutoff move out of the hot tables into
+# append-only partition files, archive/<table>/<YYYY-MM>.jsonl.gz, one gzip member per chunk.
+# archived_records maps each id to the member holding it, so a lookup decompresses one member.
+# org_stats describes the hot tables, so archived rows leave the rollup in the transaction that deletes them.
+ARCHIVED_ORDER_STATUSES = ('completed', 'cancelled')
+LOCK_NAME = 'archive_records'
+
+def _placeholders(ids):
+    return ', '.join(['%s'] * len(ids))
+
+def _partition(table, created_at):
+    return os.path.join(table, f"{created_at:%Y-%m}.jsonl.gz")
+
+def _encode(value):
+    # Timestamps are kept as ISO strings and turned back into datetimes on load, so archived rows
+    # serialise exactly like hot ones
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+def _decode(obj):
+    for key, value in obj.items():
+        if key.endswith('_at') and isinstance(value, str):
+            try:
+                obj[key] = datetime.fromisoformat(value)
+            except ValueError:
+                pass
+    return obj
+
+def _append_member(relative_path, records):
+    path = os.path.join(Config.ARCHIVE_DIR, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lines = ''.join(json.dumps(record, default=_encode) + '\n' for record in records)
+    member = gzip.compress(lines.encode('utf-8'))
+    with open(path, 'ab') as archive_file:
+        offset = archive_file.seek(0, os.SEEK_END)
+        archive_file.write(member)
+        archive_file.flush()
+        # The file must be durable before the hot rows are deleted
+        os.fsync(archive_file.fileno())
+    return offset, len(member)
+
+def _write_partitions(table, records):
+    by_partition = {}
+    for record in records:
+        by_partition.setdefault(_partition(table, record['row']['created_at']), []).append(record)
+    index_rows = []
+    for relative_path, partition_records in by_partition.items():
+        offset, length = _append_member(relative_path, partition_records)
+        index_rows.extend(
+            (table, record['row']['id'], relative_path, offset, length) for record in partition_records
+        )
+    return index_rows
+
+def _order_records(cursor, ids):
+    cursor.execute(f"SELECT * FROM orders WHERE id IN ({_placeholders(ids)})", ids)
+    orders = cursor.fetchall()
+    cursor.execute(f"""
+        SELECT oi.*, p.name as product_name
+        FROM order_items oi
+        LEFT JOIN products p ON oi.product_id = p.id
+        WHERE oi.order_id IN ({_placeholders(ids)})
+    """, ids)
+    items = {}
+    for item in cursor.fetchall():
+        items.setdefault(item['order_id'], []).append(item)
+    cursor.execute(f"""
+        SELECT id, order_id, from_status, to_status, changed_by, note, created_at
+        FROM order_status_history
+        WHERE order_id IN ({_placeholders(ids)})
+        ORDER BY created_at, id
+    """, ids)
+    history = {}
+    for entry in cursor.fetchall():
+        history.setdefault(entry['order_id'], []).append(entry)
+    return [
+        {'row': order, 'items': items.get(order['id'], []), 'history': history.get(order['id'], [])}
+        for order in orders
+    ]
+
+def _measurement_records(cursor, ids):
+    cursor.execute(f"""
+        SELECT m.*, mt.name as type_name
+        FROM measurements m
+        JOIN measurement_types mt ON m.measurement_type_id = mt.id
+        WHERE m.id IN ({_placeholders(ids)})
+    """, ids)
+    measurements = cursor.fetchall()
+    cursor.execute(f"""
+        SELECT mv.*, mf.name as field_name, mf.unit, ms.title as section_title, ms.id as section_id
+        FROM measurement_values mv
+        JOIN measurement_fields mf ON mv.field_id = mf.id
+        JOIN measurement_sections ms ON mf.section_id = ms.id
+        WHERE mv.measurement_id IN ({_placeholders(ids)})
+    """, ids)
+    values = {}
+    for value in cursor.fetchall():
+        values.setdefault(value['measurement_id'], []).append(value)
+    cursor.execute(f"""
+        SELECT measurement_id, version, changed_fields, created_at
+        FROM measurement_versions
+        WHERE measurement_id IN ({_placeholders(ids)})
+    """, ids)
+    versions = {}
+    for version in cursor.fetchall():
+        versions.setdefault(version['measurement_id'], []).append(version)
+    cursor.execute(f"""
+        SELECT measurement_id, version, field_id, value, value_numeric
+        FROM measurement_value_deltas
+        WHERE measurement_id IN ({_placeholders(ids)})
+    """, ids)
+    deltas = {}
+    for delta in cursor.fetchall():
+        deltas.setdefault(delta['measurement_id'], []).append(delta)
+
+    records = []
+    for measurement in measurements:
+        type_name = measurement.pop('type_name')
+        records.append({
+            'row': measurement,
+            'type_name': type_name,
+            'values': values.get(measurement['id'], []),
+            'versions': versions.get(measurement['id'], []),
+            'deltas': deltas.get(measurement['id'], [])
+        })
+    return records
+
+def _delete_orders(cursor, ids):
+    deltas = org_stats.removed_order_deltas(cursor, ids)
+    # Items and status history go with the order through ON DELETE CASCADE
+    cursor.execute(f"DELETE FROM orders WHERE id IN ({_placeholders(ids)})", ids)
+    org_stats.apply_deltas(deltas, cursor)
+
+def _delete_measurements(cursor, ids):
+    deltas = org_stats.removed_measurement_deltas(cursor, ids)
+    cursor.execute(f"""
+        SELECT m.id, m.user_id, ou.org_id FROM measurements m
+        LEFT JOIN org_users ou ON m.user_id = ou.id AND m.user_type = 'org_user'
+        WHERE m.id IN ({_placeholders(ids)})
+    """, ids)
+    owners = cursor.fetchall()
+    cursor.execute(f"DELETE FROM measurement_values WHERE measurement_id IN ({_placeholders(ids)})", ids)
+    cursor.execute(f"DELETE FROM measurements WHERE id IN ({_placeholders(ids)})", ids)
+    # Delta-sync clients drop archived measurements just as they drop deleted ones; the details route
+    # still finds them in the archive
+    cursor.executemany("""
+        INSERT INTO deleted_records (table_name, record_id, org_id, user_id)
+        VALUES ('measurements', %s, %s, %s)
+    """, [(owner['id'], owner['org_id'], owner['user_id']) for owner in owners])
+    org_stats.apply_deltas(deltas, cursor)
+
+ORDER_CANDIDATES = f"""
+    SELECT id FROM orders
+    WHERE status IN ({_placeholders(ARCHIVED_ORDER_STATUSES)}) AND updated_at < %s AND id > %s
+    ORDER BY id
+    LIMIT %s
+"""
+
+# Superseded: the same user took a later measurement of the same type. Ranked by creation, as analytics
+# does; updated_at moves on every edit, so it could mark the current measurement as the older one
+MEASUREMENT_CANDIDATES = """
+    SELECT m.id FROM measurements m
+    WHERE m.updated_at < %s AND m.id > %s
+      AND EXISTS (
+          SELECT 1 FROM measurements newer
+          WHERE newer.user_id = m.user_id AND newer.user_type = m.user_type
+            AND newer.measurement_type_id = m.measurement_type_id
+            AND (newer.created_at > m.created_at OR (newer.created_at = m.created_at AND newer.id > m.id))
+      )
+    ORDER BY m.id
+    LIMIT %s
+"""
+
+def _archive_table(conn, job_id, progress, table, candidates, candidate_params, load_records, delete_rows):
+    # Walks the table in id order; each chunk is written to disk first, then indexed and deleted in one
+    # short transaction. A crash in between leaves an orphaned member that the next run supersedes.
+    last_id = ''
+    while True:
+        with conn.cursor() as cursor:
+            cursor.execute(candidates, list(candidate_params) + [last_id, Config.ARCHIVE_CHUNK_SIZE])
+            ids = [row['id'] for row in cursor.fetchall()]
+            if not ids:
+                break
+            last_id = ids[-1]
+            records = load_records(cursor, ids)
+            if records:
+                index_rows = _write_partitions(table, records)
+                cursor.executemany("""
+                    INSERT INTO archived_records (table_name, record_id, partition_path, member_offset, member_length)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE partition_path = VALUES(partition_path),
+                        member_offset = VALUES(member_offset), member_length = VALUES(member_length),
+                        archived_at = CURRENT_TIMESTAMP
+                """, index_rows)
+                delete_rows(cursor, [record['row']['id'] for record in records])
+            conn.commit()
+        progress[table] = progress.get(table, 0) + len(records)
+        jobs.update_progress(job_id, progress)
+        time.sleep(Config.DELETE_THROTTLE_SECONDS)
+
+@jobs.register('archive_records')
+def archive_records(job_id, payload):
+    cutoff = datetime.now() - timedelta(days=payload.get('older_than_days', Config.ARCHIVE_AFTER_DAYS))
+    progress = {}
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            # Only one archiver may append to the partition files at a time
+            cursor.execute("SELECT GET_LOCK(%s, 0) AS acquired", (LOCK_NAME,))
+            if not cursor.fetchone()['acquired']:
+                return {'skipped': 'Another archive job is running'}
+        try:
+            _archive_table(conn, job_id, progress, 'orders', ORDER_CANDIDATES,
+                           list(ARCHIVED_ORDER_STATUSES) + [cutoff], _order_records, _delete_orders)
+            _archive_table(conn, job_id, progress, 'measurements', MEASUREMENT_CANDIDATES,
+                           [cutoff], _measurement_records, _delete_measurements)
+        finally:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return progress
+
+def load_archived(table, record_id):
+    location = execute_query("""
+        SELECT partition_path, member_offset, member_length FROM archived_records
+        WHERE table_name = %s AND record_id = %s
+    """, (table, record_id))
+    if not location:
+        return None
+    location = location[0]
+    with open(os.path.join(Config.ARCHIVE_DIR, location['partition_path']), 'rb') as archive_file:
+        archive_file.seek(location['member_offset'])
+        member = archive_file.read(location['member_length'])
+    for line in gzip.decompress(member).decode('utf-8').splitlines():
+        record = json.loads(line, object_hook=_decode)
+        if record['row']['id'] == record_id:
+            return record
+    return None
@@ -0,0 +1,23 @@
+MAX_BATCH_SIZE = 100
+
+def get_batch_ids(request):
+    # GET takes ?ids=a,b,c; POST takes {"ids": [...]} for lists too long for a URL
+    if request.method == 'POST':
+        ids = (request.get_json(silent=True) or {}).get('ids')
+        if not isinstance(ids, list):
+            raise ValueError('ids must be a list')
+    else:
+        ids = (request.args.get('ids') or '').split(',')
+    ids = list(dict.fromkeys(str(item).strip() for item in ids if str(item).strip()))
+    if not ids:
+        raise ValueError('No ids given')
+    if len(ids) > MAX_BATCH_SIZE:
+        raise ValueError(f'At most {MAX_BATCH_SIZE} ids per request')
+    return ids
+
+def placeholders(ids):
+    return ', '.join(['%s'] * len(ids))
+
+def key_by_id(rows, ids):
+    found = {row['id']: row for row in rows}
+    return found, [item for item in ids if item not in found]
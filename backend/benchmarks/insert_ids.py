@@ -0,0 +1,58 @@
+# Run from the backend directory: python -m benchmarks.insert_ids [rows] [batch_size]
+import sys
+import time
+import uuid
+from db import get_connection
+from ids import new_id, id_to_bytes
+
+def random_ids(count):
+    return [(f"mv-{uuid.uuid4().hex}",) for _ in range(count)]
+
+def ordered_ids(count):
+    return [(new_id('mv'),) for _ in range(count)]
+
+def ordered_binary_ids(count):
+    return [(id_to_bytes(new_id('mv')),) for _ in range(count)]
+
+CASES = [
+    ('random varchar', 'VARCHAR(50)', random_ids),
+    ('time-ordered varchar', 'VARCHAR(50)', ordered_ids),
+    ('time-ordered binary(16)', 'BINARY(16)', ordered_binary_ids),
+]
+
+def run_case(conn, name, column_type, generate, rows, batch_size):
+    table = 'bench_insert_ids'
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        cursor.execute(f"""
+            CREATE TABLE {table} (
+                id {column_type} PRIMARY KEY,
+                payload VARCHAR(255) NOT NULL
+            )
+        """)
+        conn.commit()
+
+        # Generated up front so the timing is the inserts alone, not uuid4 or new_id
+        ids = generate(rows)
+        started = time.perf_counter()
+        for start in range(0, rows, batch_size):
+            cursor.executemany(
+                f"INSERT INTO {table} (id, payload) VALUES (%s, 'x')",
+                ids[start:start + batch_size]
+            )
+            conn.commit()
+        elapsed = time.perf_counter() - started
+
+        cursor.execute(f"DROP TABLE {table}")
+        conn.commit()
+    print(f"{name:26s} {rows / elapsed:12.0f} rows/s ({elapsed:.2f}s)")
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    conn = get_connection()
+    try:
+        for name, column_type, generate in CASES:
+            run_case(conn, name, column_type, generate, rows, batch_size)
+    finally:
+        conn.close()
@@ -0,0 +1,67 @@
+# Run from the backend directory: python -m benchmarks.row_layouts [rows]
+import gc
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from flask import Flask
+from rows import Rows
+
+COLUMNS = ['id', 'user_id', 'user_type', 'measurement_type_id', 'current_version',
+           'created_at', 'updated_at', 'user_name', 'measurement_type_name']
+
+def fetched_tuples(count):
+    # Shaped like get_all_measurements rows as the driver returns them
+    started = datetime(2024, 1, 1)
+    return tuple(
+        (f"m-{i:08d}", f"ou-{i % 5000:06d}", 'org_user', f"mt-{i % 12:03d}", i % 7,
+         started + timedelta(seconds=i), started + timedelta(seconds=2 * i), f"User {i % 5000}", 'Shirt')
+        for i in range(count)
+    )
+
+def as_dicts(count):
+    return [dict(zip(COLUMNS, row)) for row in fetched_tuples(count)]
+
+def encode_dicts(app, rows):
+    return len(app.json.dumps({'success': True, 'measurements': rows}))
+
+def encode_rows(app, rows, layout):
+    # Chunks are handed to the WSGI server as they are produced, so only their size is kept
+    return sum(len(chunk) for chunk in Rows(COLUMNS, rows).iter_json('measurements', layout, success=True))
+
+class GcTimer:
+    def __init__(self):
+        self.total = 0
+        self.started = None
+
+    def __call__(self, phase, info):
+        if phase == 'start':
+            self.started = time.perf_counter()
+        elif self.started is not None:
+            self.total += time.perf_counter() - self.started
+
+def measure(name, build, encode):
+    gc.collect()
+    timer = GcTimer()
+    gc.callbacks.append(timer)
+    started = time.perf_counter()
+    size = encode(build())
+    elapsed = time.perf_counter() - started
+    gc.callbacks.remove(timer)
+
+    # Peak memory is taken on a separate run, since tracing allocations distorts the timings
+    gc.collect()
+    tracemalloc.start()
+    encode(build())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:22s} {elapsed:7.2f}s  gc {timer.total * 1000:8.1f} ms  peak {peak / 2 ** 20:8.1f} MiB  "
+          f"payload {size / 2 ** 20:6.1f} MiB")
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    app = Flask(__name__)
+    with app.app_context():
+        measure('dict per row', lambda: as_dicts(count), lambda rows: encode_dicts(app, rows))
+        measure('tuples, objects', lambda: fetched_tuples(count), lambda rows: encode_rows(app, rows, 'objects'))
+        measure('tuples, columns', lambda: fetched_tuples(count), lambda rows: encode_rows(app, rows, 'columns'))
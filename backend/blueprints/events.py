@@ -0,0 +1,42 @@
+import queue
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from broadcaster import broadcaster, format_sse
+from config import Config
+
+events = Blueprint('events', __name__, url_prefix='/api/events')
+
+@events.route('/stream', methods=['GET'])
+def stream_events():
+    org_id = request.args.get('org_id')
+    if not org_id:
+        return jsonify({'success': False, 'message': 'org_id is required'}), 400
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    subscription, replay, needs_reset = broadcaster.subscribe(org_id, last_event_id)
+
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            if needs_reset:
+                # Events the client missed are gone from the buffer, so it must reload its snapshot
+                yield "event: reset\ndata: {}\n\n"
+            for event in replay:
+                yield format_sse(event)
+            while not subscription.overflowed:
+                try:
+                    event = subscription.queue.get(timeout=Config.EVENT_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
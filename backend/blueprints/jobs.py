@@ -0,0 +1,63 @@
+import logging
+from flask import Blueprint, request, jsonify
+import jobs
+
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/api/jobs')
+
+@jobs_bp.route('/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    try:
+        job = jobs.get_job(job_id)
+        
+        if not job:
+            return jsonify({'success': False, 'message': 'Job not found'}), 404
+        
+        return jsonify({'success': True, 'job': job})
+    except Exception as e:
+        logging.error(f"Get job error: {str(e)}")
+        return jsonify({'success': False, 'message': 'Failed to fetch job'}), 500
+
+@jobs_bp.route('/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    try:
+        job = jobs.get_job_result(job_id)
+        
+        if not job:
+            return jsonify({'success': False, 'message': 'Job not found'}), 404
+        
+        if job['status'] != 'completed':
+            return jsonify({'success': False, 'status': job['status'], 'message': 'Job has not completed'}), 409
+        
+        return jsonify({'success': True, 'result': job['result']})
+    except Exception as e:
+        logging.error(f"Get job result error: {str(e)}")
+        return jsonify({'success': False, 'message': 'Failed to fetch job result'}), 500
+
+@jobs_bp.route('/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    try:
+        job = jobs.cancel(job_id)
+        
+        if not job:
+            return jsonify({'success': False, 'message': 'Job not found'}), 404
+        
+        return jsonify({'success': True, 'job': job})
+    except Exception as e:
+        logging.error(f"Cancel job error: {str(e)}")
+        return jsonify({'success': False, 'message': 'Failed to cancel job'}), 500
+
+@jobs_bp.route('/archive', methods=['POST'])
+def start_archive():
+    try:
+        data = request.get_json(silent=True) or {}
+        payload = {}
+        if 'older_than_days' in data:
+            if not isinstance(data['older_than_days'], int) or data['older_than_days'] < 1:
+                return jsonify({'success': False, 'message': 'older_than_days must be a positive integer'}), 400
+            payload['older_than_days'] = data['older_than_days']
+        
+        job_id = jobs.submit('archive_records', payload)
+        return jsonify({'success': True, 'job_id': job_id}), 202
+    except Exception as e:
+        logging.error(f"Start archive error: {str(e)}")
+        return jsonify({'success': False, 'message': 'Failed to start archive job'}), 500
@@ -1,16 +1,68 @@
-import uuid
 from flask import Blueprint, request, jsonify
-from db import execute_query, execute_many
+from config import Config
+from db import execute_query, execute_rows, get_connection
+from ids import new_id
+from units import parse_measurement, load_field_units
+from analytics import size_distribution, latest_measurement_values, DEFAULT_PERCENTILES
+from measurement_versions import write_version, list_versions, reconstruct_version
+from measurement_documents import group_values_by_section, refresh_document, load_document, flatten_document
+from broadcaster import broadcaster
+import org_stats
+import roster
+import archive
+import jobs
+from sync import parse_since, current_sync_cursor, record_tombstone, get_tombstones
+from projection import select_columns
+from batch import get_batch_ids, placeholders, key_by_id
+from rows import parse_layout
 
 measurements = Blueprint('measurements', __name__, url_prefix='/api/measurements')
 
+TYPE_FIELDS = {
+    'id': 'id', 'name': 'name', 'description': 'description', 'template_version': 'template_version',
+    'created_at': 'created_at', 'updated_at': 'updated_at',
+}
+ORG_MEASUREMENT_FIELDS = {
+    'id': 'm.id', 'user_id': 'm.user_id', 'user_type': 'm.user_type', 'measurement_type_id': 'm.measurement_type_id',
+    'current_version': 'm.current_version', 'created_at': 'm.created_at', 'updated_at': 'm.updated_at',
+    'user_name': 'ou.name', 'measurement_type': 'mt.name',
+}
+MEASUREMENT_FIELDS = {
+    'id': 'm.id', 'user_id': 'm.user_id', 'user_type': 'm.user_type', 'measurement_type_id': 'm.measurement_type_id',
+    'current_version': 'm.current_version', 'created_at': 'm.created_at', 'updated_at': 'm.updated_at',
+    'user_name': """CASE 
+                     WHEN m.user_type = 'org_user' THEN ou.name 
+                     WHEN m.user_type = 'individual' THEN i.name 
+                   END""",
+    'measurement_type_name': 'mt.name',
+}
+
+def _measurement_org_id(user_id, user_type):
+    if user_type != 'org_user':
+        return None
+    org = execute_query("SELECT org_id FROM org_users WHERE id = %s", (user_id,))
+    return org[0]['org_id'] if org else None
+
+def _publish_measurement_event(event_type, org_id, measurement_id, user_id, user_type, type_id):
+    if org_id:
+        roster.invalidate_roster(org_id)
+    broadcaster.publish(event_type, org_id, {
+        'measurement_id': measurement_id,
+        'user_id': user_id,
+        'user_type': user_type,
+        'type_id': type_id
+    })
+
 @measurements.route('/types', methods=['GET'])
 def get_measurement_types():
     try:
-        query = "SELECT * FROM measurement_types"
+        columns = select_columns(TYPE_FIELDS, request.args.get('fields'))
+        query = f"SELECT {columns} FROM measurement_types"
         result = execute_query(query)
         
         return jsonify({'success': True, 'types': result})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -22,7 +74,7 @@ def add_measurement_type():
         return jsonify({'success': False, 'message': 'Missing name field'}), 400
     
     try:
-        type_id = f"mt-{uuid.uuid4().hex[:8]}"
+        type_id = new_id('mt')
         query = "INSERT INTO measurement_types (id, name, description) VALUES (%s, %s, %s)"
         execute_query(query, (type_id, data['name'], data.get('description')), fetch=False)
         
@@ -30,18 +82,214 @@ def add_measurement_type():
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+def _template_rows(type_id, sections):
+    section_rows = []
+    field_rows = []
+    for section_order, section in enumerate(sections):
+        section_id = new_id('ms')
+        section_rows.append((section_id, type_id, section['title'], section.get('display_order', section_order)))
+        for field_order, field in enumerate(section.get('fields', [])):
+            field_rows.append((
+                new_id('mf'), section_id, field['name'], field.get('unit'),
+                field.get('display_order', field_order)
+            ))
+    return section_rows, field_rows
+
+def _insert_template(cursor, type_id, name, description, sections):
+    section_rows, field_rows = _template_rows(type_id, sections)
+    cursor.execute(
+        "INSERT INTO measurement_types (id, name, description) VALUES (%s, %s, %s)",
+        (type_id, name, description)
+    )
+    if section_rows:
+        cursor.executemany("""
+            INSERT INTO measurement_sections (id, measurement_type_id, title, display_order)
+            VALUES (%s, %s, %s, %s)
+        """, section_rows)
+    if field_rows:
+        cursor.executemany("""
+            INSERT INTO measurement_fields (id, section_id, name, unit, display_order)
+            VALUES (%s, %s, %s, %s, %s)
+        """, field_rows)
+    return len(section_rows), len(field_rows)
+
+def _valid_template(sections):
+    return isinstance(sections, list) and all(
+        isinstance(section, dict) and section.get('title') and isinstance(section.get('fields', []), list)
+        and all(isinstance(field, dict) and field.get('name') for field in section.get('fields', []))
+        for section in sections
+    )
+
+@measurements.route('/template', methods=['POST'])
+def create_measurement_template():
+    data = request.get_json()
+    
+    if not data or 'name' not in data or not _valid_template(data.get('sections')):
+        return jsonify({'success': False, 'message': 'Missing name or invalid sections'}), 400
+    
+    try:
+        type_id = new_id('mt')
+        conn = get_connection()
+        try:
+            with conn.cursor() as cursor:
+                section_count, field_count = _insert_template(
+                    cursor, type_id, data['name'], data.get('description'), data['sections']
+                )
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        return jsonify({
+            'success': True,
+            'id': type_id,
+            'sections': section_count,
+            'fields': field_count,
+            'message': 'Measurement template created successfully'
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@measurements.route('/type/<type_id>/clone', methods=['POST'])
+def clone_measurement_template(type_id):
+    data = request.get_json() or {}
+    
+    try:
+        conn = get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT name, description FROM measurement_types WHERE id = %s", (type_id,))
+                source = cursor.fetchone()
+                if not source:
+                    return jsonify({'success': False, 'message': 'Measurement type not found'}), 404
+                
+                cursor.execute("""
+                    SELECT id, title, display_order FROM measurement_sections
+                    WHERE measurement_type_id = %s ORDER BY display_order
+                """, (type_id,))
+                sections = cursor.fetchall()
+                cursor.execute("""
+                    SELECT mf.section_id, mf.name, mf.unit, mf.display_order
+                    FROM measurement_fields mf
+                    JOIN measurement_sections ms ON mf.section_id = ms.id
+                    WHERE ms.measurement_type_id = %s
+                    ORDER BY mf.display_order
+                """, (type_id,))
+                fields_by_section = {}
+                for field in cursor.fetchall():
+                    fields_by_section.setdefault(field['section_id'], []).append(field)
+                for section in sections:
+                    section['fields'] = fields_by_section.get(section['id'], [])
+                
+                clone_id = new_id('mt')
+                _insert_template(
+                    cursor, clone_id, data.get('name', f"{source['name']} (copy)"),
+                    data.get('description', source['description']), sections
+                )
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        return jsonify({'success': True, 'id': clone_id, 'message': 'Measurement template cloned successfully'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@measurements.route('/type/<type_id>/order', methods=['PUT'])
+def reorder_measurement_template(type_id):
+    data = request.get_json()
+    
+    if not data or not (data.get('sections') or data.get('fields')):
+        return jsonify({'success': False, 'message': 'Nothing to reorder'}), 400
+    
+    try:
+        conn = get_connection()
+        try:
+            with conn.cursor() as cursor:
+                # Locking the type row serialises template edits and the version bump
+                cursor.execute(
+                    "SELECT template_version FROM measurement_types WHERE id = %s FOR UPDATE", (type_id,)
+                )
+                template = cursor.fetchone()
+                if not template:
+                    return jsonify({'success': False, 'message': 'Measurement type not found'}), 404
+                
+                for table, key, scope in [
+                    ('measurement_sections', 'sections', "measurement_type_id = %s"),
+                    ('measurement_fields', 'fields',
+                     "section_id IN (SELECT id FROM measurement_sections WHERE measurement_type_id = %s)")
+                ]:
+                    items = data.get(key) or []
+                    if not items:
+                        continue
+                    cases = ' '.join(['WHEN %s THEN %s'] * len(items))
+                    placeholders = ', '.join(['%s'] * len(items))
+                    params = [value for item in items for value in (item['id'], int(item['display_order']))]
+                    params += [item['id'] for item in items] + [type_id]
+                    cursor.execute(f"""
+                        UPDATE {table} SET display_order = CASE id {cases} END
+                        WHERE id IN ({placeholders}) AND {scope}
+                    """, params)
+                
+                cursor.execute(
+                    "UPDATE measurement_types SET template_version = template_version + 1 WHERE id = %s", (type_id,)
+                )
+                # Stored documents carry the old section and field order; clearing them in the same
+                # transaction sends readers to the joins until the job has rebuilt them. updated_at is kept,
+                # as for any document refresh
+                cursor.execute(
+                    "UPDATE measurements SET document = NULL, updated_at = updated_at WHERE measurement_type_id = %s",
+                    (type_id,)
+                )
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        jobs.submit('refresh_documents', {'type_id': type_id})
+        return jsonify({
+            'success': True,
+            'template_version': template['template_version'] + 1,
+            'message': 'Measurement template reordered successfully'
+        })
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Each entry needs an id and a numeric display_order'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @measurements.route('/type/<type_id>/sections', methods=['GET'])
 def get_measurement_sections(type_id):
     try:
+        type_query = "SELECT template_version FROM measurement_types WHERE id = %s"
+        type_result = execute_query(type_query, (type_id,))
+        
         query = "SELECT * FROM measurement_sections WHERE measurement_type_id = %s ORDER BY display_order"
         sections = execute_query(query, (type_id,))
         
+        fields_query = """
+            SELECT mf.* FROM measurement_fields mf
+            JOIN measurement_sections ms ON mf.section_id = ms.id
+            WHERE ms.measurement_type_id = %s
+            ORDER BY mf.display_order
+        """
+        fields_by_section = {}
+        for field in execute_query(fields_query, (type_id,)):
+            fields_by_section.setdefault(field['section_id'], []).append(field)
+        
         for section in sections:
-            fields_query = "SELECT * FROM measurement_fields WHERE section_id = %s ORDER BY display_order"
-            fields = execute_query(fields_query, (section['id'],))
-            section['fields'] = fields
+            section['fields'] = fields_by_section.get(section['id'], [])
         
-        return jsonify({'success': True, 'sections': sections})
+        return jsonify({
+            'success': True,
+            'template_version': type_result[0]['template_version'] if type_result else None,
+            'sections': sections
+        })
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -51,17 +299,39 @@ def get_measurements(user_id, user_type):
         if user_type not in ['org_user', 'individual']:
             return jsonify({'success': False, 'message': 'Invalid user type'}), 400
         
+        since = parse_since(request.args.get('since'))
+        cursor = current_sync_cursor(since)
+        
         query = "SELECT * FROM measurements WHERE user_id = %s AND user_type = %s"
-        measurements_list = execute_query(query, (user_id, user_type))
+        params = [user_id, user_type]
+        if since:
+            query += " AND updated_at >= %s"
+            params.append(since)
+        measurements_list = execute_query(query, params)
         
         result = []
         for m in measurements_list:
+            document = load_document(m.get('document'))
+            if document is not None:
+                result.append({
+                    'id': m['id'],
+                    'type_id': m['measurement_type_id'],
+                    'type_name': document['type_name'],
+                    'created_at': m['created_at'],
+                    'updated_at': m['updated_at'],
+                    'values': flatten_document(m['id'], document)
+                })
+                continue
+            
+            # Exactly the keys flatten_document produces, so the shape doesn't depend on a stored document
             values_query = """
-                SELECT mv.*, mf.name as field_name, mf.unit, ms.title as section_title 
+                SELECT mv.id, mv.measurement_id, mv.field_id, mv.value, mf.name as field_name, mf.unit,
+                       ms.title as section_title
                 FROM measurement_values mv
                 JOIN measurement_fields mf ON mv.field_id = mf.id
                 JOIN measurement_sections ms ON mf.section_id = ms.id
                 WHERE mv.measurement_id = %s
+                ORDER BY ms.display_order, mf.display_order
             """
             values = execute_query(values_query, (m['id'],))
             
@@ -77,79 +347,207 @@ def get_measurements(user_id, user_type):
                 'values': values
             })
         
-        return jsonify({'success': True, 'measurements': result})
+        response = {'success': True, 'measurements': result, 'sync_cursor': cursor}
+        if since:
+            response['deleted'] = get_tombstones('measurements', since, user_id=user_id)
+        return jsonify(response)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @measurements.route('/<org_id>/org_measurements', methods=['GET'])
 def get_org_measurements(org_id):
     try:
-        query = """
-            SELECT m.*, ou.name as user_name, mt.name as measurement_type 
+        since = parse_since(request.args.get('since'))
+        cursor = current_sync_cursor(since)
+        
+        columns = select_columns(ORG_MEASUREMENT_FIELDS, request.args.get('fields'))
+        query = f"""
+            SELECT {columns}
             FROM measurements m
             JOIN org_users ou ON m.user_id = ou.id
             JOIN measurement_types mt ON m.measurement_type_id = mt.id
             WHERE m.user_type = 'org_user' AND ou.org_id = %s
         """
-        result = execute_query(query, (org_id,))
+        params = [org_id]
+        if since:
+            query += " AND m.updated_at >= %s"
+            params.append(since)
+        result = execute_query(query, params)
+        
+        response = {'success': True, 'measurements': result, 'sync_cursor': cursor}
+        if since:
+            response['deleted'] = get_tombstones('measurements', since, org_id=org_id)
+        return jsonify(response)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@measurements.route('/<org_id>/analytics/<type_id>', methods=['GET'])
+def get_size_analytics(org_id, type_id):
+    try:
+        percentiles = DEFAULT_PERCENTILES
+        if request.args.get('percentiles'):
+            percentiles = [float(p) for p in request.args['percentiles'].split(',')]
+            if not all(0 <= p <= 100 for p in percentiles):
+                raise ValueError('Percentiles must be between 0 and 100')
+        bins = int(request.args.get('bins', 10))
+        if not 1 <= bins <= Config.MAX_HISTOGRAM_BINS:
+            raise ValueError(f'Bins must be between 1 and {Config.MAX_HISTOGRAM_BINS}')
+        
+        # Only each user's latest measurement of this type counts towards the size run
+        rows = latest_measurement_values(org_id, type_id)
+        
+        distribution = size_distribution(
+            [row['field_id'] for row in rows],
+            [row['measurement_id'] for row in rows],
+            [row['value_numeric'] for row in rows],
+            percentiles=percentiles,
+            bins=bins
+        )
+        
+        fields_query = """
+            SELECT mf.id, mf.name, ms.title as section_title
+            FROM measurement_fields mf
+            JOIN measurement_sections ms ON mf.section_id = ms.id
+            WHERE ms.measurement_type_id = %s
+        """
+        for field in execute_query(fields_query, (type_id,)):
+            if field['id'] in distribution:
+                distribution[field['id']]['field_name'] = field['name']
+                distribution[field['id']]['section_title'] = field['section_title']
         
-        return jsonify({'success': True, 'measurements': result})
+        return jsonify({'success': True, 'unit': 'cm', 'fields': distribution})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+MEASUREMENT_DETAIL_QUERY = """
+    SELECT id, user_id, user_type, measurement_type_id, current_version, document, created_at, updated_at
+    FROM measurements
+"""
+
+def _fallback_documents(rows):
+    # Rows without a stored document are rebuilt from the joins, one query per table for the whole batch
+    if not rows:
+        return {}
+    measurement_ids = [row['id'] for row in rows]
+    type_ids = list({row['measurement_type_id'] for row in rows})
+    type_query = f"SELECT id, name FROM measurement_types WHERE id IN ({placeholders(type_ids)})"
+    type_names = {row['id']: row['name'] for row in execute_query(type_query, type_ids)}
+    
+    values_query = f"""
+        SELECT mv.*, mf.name as field_name, mf.unit, ms.title as section_title, ms.id as section_id
+        FROM measurement_values mv
+        JOIN measurement_fields mf ON mv.field_id = mf.id
+        JOIN measurement_sections ms ON mf.section_id = ms.id
+        WHERE mv.measurement_id IN ({placeholders(measurement_ids)})
+        ORDER BY ms.display_order, mf.display_order
+    """
+    values_by_measurement = {}
+    for value in execute_query(values_query, measurement_ids):
+        values_by_measurement.setdefault(value['measurement_id'], []).append(value)
+    
+    return {
+        row['id']: {
+            'type_name': type_names.get(row['measurement_type_id'], ''),
+            'sections': group_values_by_section(values_by_measurement.get(row['id'], []))
+        }
+        for row in rows
+    }
+
+def _measurement_details(rows):
+    # The stored document makes this a primary-key read; older rows fall back to the joins
+    documents = {row['id']: load_document(row['document']) for row in rows}
+    documents.update(_fallback_documents([row for row in rows if documents[row['id']] is None]))
+    return [{
+        'id': row['id'],
+        'user_id': row['user_id'],
+        'user_type': row['user_type'],
+        'type_id': row['measurement_type_id'],
+        'type_name': documents[row['id']]['type_name'],
+        'created_at': row['created_at'],
+        'updated_at': row['updated_at'],
+        'version': row['current_version'],
+        'sections': documents[row['id']]['sections']
+    } for row in rows]
+
+def _archived_measurement_details(archived):
+    row = archived['row']
+    document = load_document(row['document']) or {
+        'type_name': archived['type_name'],
+        'sections': group_values_by_section(archived['values'])
+    }
+    return {
+        'id': row['id'],
+        'user_id': row['user_id'],
+        'user_type': row['user_type'],
+        'type_id': row['measurement_type_id'],
+        'type_name': document['type_name'],
+        'created_at': row['created_at'],
+        'updated_at': row['updated_at'],
+        'version': row['current_version'],
+        'sections': document['sections'],
+        'archived': True
+    }
+
+@measurements.route('/batch', methods=['GET', 'POST'])
+def get_measurement_details_batch():
+    try:
+        ids = get_batch_ids(request)
+        rows = execute_query(MEASUREMENT_DETAIL_QUERY + f"WHERE id IN ({placeholders(ids)})", ids)
+        found, missing = key_by_id(_measurement_details(rows), ids)
+        
+        return jsonify({'success': True, 'measurements': found, 'missing': missing})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @measurements.route('/<measurement_id>', methods=['GET'])
 def get_measurement_details(measurement_id):
     try:
-        query = """
-            SELECT m.*, mt.name as type_name 
-            FROM measurements m
-            JOIN measurement_types mt ON m.measurement_type_id = mt.id
-            WHERE m.id = %s
-        """
-        measurement = execute_query(query, (measurement_id,))
+        measurement = execute_query(MEASUREMENT_DETAIL_QUERY + "WHERE id = %s", (measurement_id,))
         
         if not measurement:
+            archived = archive.load_archived('measurements', measurement_id)
+            if archived:
+                return jsonify({'success': True, 'measurement': _archived_measurement_details(archived)})
             return jsonify({'success': False, 'message': 'Measurement not found'}), 404
         
-        values_query = """
-            SELECT mv.*, mf.name as field_name, mf.unit, ms.title as section_title, ms.id as section_id
-            FROM measurement_values mv
-            JOIN measurement_fields mf ON mv.field_id = mf.id
-            JOIN measurement_sections ms ON mf.section_id = ms.id
-            WHERE mv.measurement_id = %s
-        """
-        values = execute_query(values_query, (measurement_id,))
-        
-        # Group values by section
-        sections = {}
-        for value in values:
-            section_id = value['section_id']
-            if section_id not in sections:
-                sections[section_id] = {
-                    'id': section_id,
-                    'title': value['section_title'],
-                    'values': []
-                }
-            sections[section_id]['values'].append({
-                'id': value['id'],
-                'field_id': value['field_id'],
-                'field_name': value['field_name'],
-                'unit': value['unit'],
-                'value': value['value']
-            })
+        return jsonify({'success': True, 'measurement': _measurement_details(measurement)[0]})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@measurements.route('/<measurement_id>/versions', methods=['GET'])
+def get_measurement_versions(measurement_id):
+    try:
+        versions = list_versions(measurement_id)
         
-        result = {
-            'id': measurement[0]['id'],
-            'user_id': measurement[0]['user_id'],
-            'user_type': measurement[0]['user_type'],
-            'type_id': measurement[0]['measurement_type_id'],
-            'type_name': measurement[0]['type_name'],
-            'created_at': measurement[0]['created_at'],
-            'updated_at': measurement[0]['updated_at'],
-            'sections': list(sections.values())
-        }
+        return jsonify({'success': True, 'versions': versions})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@measurements.route('/<measurement_id>/versions/<int:version>', methods=['GET'])
+def get_measurement_version(measurement_id, version):
+    try:
+        query = "SELECT current_version FROM measurements WHERE id = %s"
+        measurement = execute_query(query, (measurement_id,))
+        
+        if not measurement or version < 1 or version > measurement[0]['current_version']:
+            return jsonify({'success': False, 'message': 'Version not found'}), 404
         
-        return jsonify({'success': True, 'measurement': result})
+        values = reconstruct_version(measurement_id, version)
+        
+        return jsonify({
+            'success': True,
+            'measurement_id': measurement_id,
+            'version': version,
+            'sections': group_values_by_section(values)
+        })
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -164,32 +562,48 @@ def add_measurements():
         return jsonify({'success': False, 'message': 'Values must be a non-empty list'}), 400
     
     try:
-        measurement_id = f"m-{uuid.uuid4().hex[:8]}"
+        measurement_id = new_id('m')
+        units = load_field_units([v['field_id'] for v in data['values'] if 'field_id' in v])
         
-        # Insert measurement record
-        query = """
-            INSERT INTO measurements (id, user_id, user_type, measurement_type_id)
-            VALUES (%s, %s, %s, %s)
-        """
-        execute_query(query, (
-            measurement_id, data['user_id'], data['user_type'], data['measurement_type_id']
-        ), fetch=False)
-        
-        # Insert measurement values
         values_params = []
         for value in data['values']:
             if 'field_id' not in value or 'value' not in value:
                 continue
             
-            value_id = f"mv-{uuid.uuid4().hex[:8]}"
-            values_params.append((value_id, measurement_id, value['field_id'], value['value']))
+            value_id = new_id('mv')
+            numeric = parse_measurement(value['value'], units.get(value['field_id']))
+            values_params.append((value_id, measurement_id, value['field_id'], value['value'], numeric))
         
-        if values_params:
-            values_query = """
-                INSERT INTO measurement_values (id, measurement_id, field_id, value)
-                VALUES (%s, %s, %s, %s)
-            """
-            execute_many(values_query, values_params)
+        # The measurement, its values, its first version and its document commit together
+        conn = get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO measurements (id, user_id, user_type, measurement_type_id, current_version)
+                    VALUES (%s, %s, %s, %s, 1)
+                """, (measurement_id, data['user_id'], data['user_type'], data['measurement_type_id']))
+                
+                if values_params:
+                    cursor.executemany("""
+                        INSERT INTO measurement_values (id, measurement_id, field_id, value, value_numeric)
+                        VALUES (%s, %s, %s, %s, %s)
+                    """, values_params)
+                
+                write_version(measurement_id, 1, [(row[2], row[3], row[4]) for row in values_params], cursor)
+                refresh_document(cursor, measurement_id)
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        org_id = _measurement_org_id(data['user_id'], data['user_type'])
+        org_stats.apply_deltas([(org_id, org_stats.MEASUREMENTS, data['measurement_type_id'], 1)])
+        _publish_measurement_event(
+            'measurement_created', org_id, measurement_id, data['user_id'], data['user_type'],
+            data['measurement_type_id']
+        )
         
         return jsonify({
             'success': True,
@@ -207,53 +621,110 @@ def update_measurements(measurement_id):
         return jsonify({'success': False, 'message': 'Missing or invalid values field'}), 400
     
     try:
-        # First, check if measurement exists
-        check_query = "SELECT id FROM measurements WHERE id = %s"
-        exists = execute_query(check_query, (measurement_id,))
+        conn = get_connection()
+        try:
+            with conn.cursor() as cursor:
+                # First, check if measurement exists
+                cursor.execute("""
+                    SELECT id, user_id, user_type, measurement_type_id, current_version
+                    FROM measurements WHERE id = %s FOR UPDATE
+                """, (measurement_id,))
+                measurement = cursor.fetchone()
+                
+                if not measurement:
+                    return jsonify({'success': False, 'message': 'Measurement not found'}), 404
+                
+                # Load the existing values once so both lookups and unit normalisation need no further queries
+                cursor.execute(
+                    "SELECT id, field_id, value, value_numeric FROM measurement_values WHERE measurement_id = %s",
+                    (measurement_id,)
+                )
+                existing_values = cursor.fetchall()
+                field_by_value_id = {row['id']: row['field_id'] for row in existing_values}
+                value_id_by_field = {row['field_id']: row['id'] for row in existing_values}
+                previous = {row['field_id']: row['value'] for row in existing_values}
+                changes = {}
+                units = load_field_units(
+                    list(field_by_value_id.values()) + [v['field_id'] for v in data['values'] if 'field_id' in v]
+                )
+                
+                # Update measurement values
+                for value in data['values']:
+                    if 'id' in value and 'value' in value:
+                        field_id = field_by_value_id.get(value['id'])
+                    elif 'field_id' in value and 'value' in value:
+                        field_id = value['field_id']
+                    else:
+                        continue
+                    if field_id is None or previous.get(field_id) == str(value['value']):
+                        continue
+                    
+                    numeric = parse_measurement(value['value'], units.get(field_id))
+                    existing_value_id = value_id_by_field.get(field_id)
+                    if existing_value_id:
+                        # Update existing value
+                        cursor.execute(
+                            "UPDATE measurement_values SET value = %s, value_numeric = %s WHERE id = %s",
+                            (value['value'], numeric, existing_value_id)
+                        )
+                    else:
+                        # Insert new value
+                        value_id = new_id('mv')
+                        cursor.execute("""
+                            INSERT INTO measurement_values (id, measurement_id, field_id, value, value_numeric)
+                            VALUES (%s, %s, %s, %s, %s)
+                        """, (value_id, measurement_id, field_id, value['value'], numeric))
+                        value_id_by_field[field_id] = value_id
+                    changes[field_id] = (field_id, value['value'], numeric)
+                    previous[field_id] = str(value['value'])
+                
+                if not changes:
+                    return jsonify({'success': True, 'message': 'Measurements unchanged'})
+                
+                # Only the changed fields are stored for the new version
+                version = measurement['current_version']
+                if version == 0:
+                    # Measurements saved before versioning get their current values as a baseline first
+                    version = 1
+                    write_version(measurement_id, version, [
+                        (row['field_id'], row['value'], row['value_numeric']) for row in existing_values
+                    ], cursor)
+                version += 1
+                write_version(measurement_id, version, list(changes.values()), cursor)
+                
+                # Update the measurement's updated_at timestamp
+                cursor.execute(
+                    "UPDATE measurements SET updated_at = CURRENT_TIMESTAMP, current_version = %s WHERE id = %s",
+                    (version, measurement_id)
+                )
+                refresh_document(cursor, measurement_id)
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
         
-        if not exists:
-            return jsonify({'success': False, 'message': 'Measurement not found'}), 404
+        _publish_measurement_event(
+            'measurement_updated', _measurement_org_id(measurement['user_id'], measurement['user_type']),
+            measurement_id, measurement['user_id'], measurement['user_type'], measurement['measurement_type_id']
+        )
         
-        # Update measurement values
-        for value in data['values']:
-            if 'id' in value and 'value' in value:
-                # Update existing value
-                update_query = "UPDATE measurement_values SET value = %s WHERE id = %s AND measurement_id = %s"
-                execute_query(update_query, (value['value'], value['id'], measurement_id), fetch=False)
-            elif 'field_id' in value and 'value' in value:
-                # Check if value exists for this field
-                check_value_query = """
-                    SELECT id FROM measurement_values 
-                    WHERE measurement_id = %s AND field_id = %s
-                """
-                existing_value = execute_query(check_value_query, (measurement_id, value['field_id']))
-                
-                if existing_value:
-                    # Update existing value
-                    update_query = "UPDATE measurement_values SET value = %s WHERE id = %s"
-                    execute_query(update_query, (value['value'], existing_value[0]['id']), fetch=False)
-                else:
-                    # Insert new value
-                    value_id = f"mv-{uuid.uuid4().hex[:8]}"
-                    insert_query = """
-                        INSERT INTO measurement_values (id, measurement_id, field_id, value)
-                        VALUES (%s, %s, %s, %s)
-                    """
-                    execute_query(insert_query, (
-                        value_id, measurement_id, value['field_id'], value['value']
-                    ), fetch=False)
-        
-        # Update the measurement's updated_at timestamp
-        update_measurement_query = "UPDATE measurements SET updated_at = CURRENT_TIMESTAMP WHERE id = %s"
-        execute_query(update_measurement_query, (measurement_id,), fetch=False)
-        
-        return jsonify({'success': True, 'message': 'Measurements updated successfully'})
+        return jsonify({'success': True, 'version': version, 'message': 'Measurements updated successfully'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @measurements.route('/<measurement_id>', methods=['DELETE'])
 def delete_measurement(measurement_id):
     try:
+        owner_query = """
+            SELECT m.user_id, m.measurement_type_id, ou.org_id
+            FROM measurements m
+            LEFT JOIN org_users ou ON m.user_id = ou.id AND m.user_type = 'org_user'
+            WHERE m.id = %s
+        """
+        owner = execute_query(owner_query, (measurement_id,))
+        
         # Delete all measurement values first (cascading would work too but being explicit)
         values_query = "DELETE FROM measurement_values WHERE measurement_id = %s"
         execute_query(values_query, (measurement_id,), fetch=False)
@@ -262,6 +733,11 @@ def delete_measurement(measurement_id):
         query = "DELETE FROM measurements WHERE id = %s"
         execute_query(query, (measurement_id,), fetch=False)
         
+        if owner:
+            record_tombstone('measurements', measurement_id, org_id=owner[0]['org_id'], user_id=owner[0]['user_id'])
+            org_stats.apply_deltas([(owner[0]['org_id'], org_stats.MEASUREMENTS, owner[0]['measurement_type_id'], -1)])
+            roster.invalidate_roster(owner[0]['org_id'])
+        
         return jsonify({'success': True, 'message': 'Measurement deleted successfully'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -269,20 +745,20 @@ def delete_measurement(measurement_id):
 @measurements.route('/all', methods=['GET'])
 def get_all_measurements():
     try:
-        query = """
-            SELECT m.*, 
-                   CASE 
-                     WHEN m.user_type = 'org_user' THEN ou.name 
-                     WHEN m.user_type = 'individual' THEN i.name 
-                   END as user_name,
-                   mt.name as measurement_type_name
+        columns = select_columns(MEASUREMENT_FIELDS, request.args.get('fields'))
+        query = f"""
+            SELECT {columns}
             FROM measurements m
             LEFT JOIN org_users ou ON m.user_id = ou.id AND m.user_type = 'org_user'
             LEFT JOIN individuals i ON m.user_id = i.id AND m.user_type = 'individual'
             JOIN measurement_types mt ON m.measurement_type_id = mt.id
         """
-        result = execute_query(query)
+        layout = parse_layout(request.args.get('layout'))
+        # Every measurement in the system: kept as tuples and encoded in chunks rather than a dict per row
+        result = execute_rows(query)
         
-        return jsonify({'success': True, 'measurements': result})
+        return result.json_response('measurements', layout, success=True)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
\ No newline at end of file
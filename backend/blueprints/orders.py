@@ -1,45 +1,465 @@
+from datetime import datetime
+from decimal import Decimal
 from flask import Blueprint, request, jsonify
-from db import get_connection
-import uuid
+from db import get_connection, StatementTimeout
+from ids import new_id
+from broadcaster import broadcaster
+import org_stats
+import roster
+from pagination import get_page_size, encode_cursor, decode_cursor
+from projection import select_columns, parse_fields
+import archive
 
 orders_bp = Blueprint('orders', __name__, url_prefix='/orders')
 
+ORDER_FIELDS = {
+    'id': 'id', 'user_id': 'user_id', 'user_type': 'user_type', 'org_user_id': 'org_user_id', 'org_id': 'org_id',
+    'status': 'status', 'total_amount': 'total_amount', 'created_at': 'created_at', 'updated_at': 'updated_at',
+}
+
+MAX_BULK_ORDERS = 1000
+MAX_BULK_STATUS_UPDATES = 1000
+
+# Orders move forward through production; cancelling is only possible before completion
+ORDER_STATUS_FLOW = ['pending', 'processing', 'stitched', 'dispatched', 'completed']
+CANCELLED = 'cancelled'
+
+def _can_transition(from_status, to_status):
+    if from_status == to_status or from_status not in ORDER_STATUS_FLOW:
+        return False
+    if to_status == CANCELLED:
+        return from_status != 'completed'
+    if to_status not in ORDER_STATUS_FLOW:
+        return False
+    return ORDER_STATUS_FLOW.index(to_status) > ORDER_STATUS_FLOW.index(from_status)
+
+def _insert_history(cursor, rows):
+    # rows are (order_id, from_status, to_status, changed_by, note)
+    if rows:
+        cursor.executemany("""
+            INSERT INTO order_status_history (id, order_id, from_status, to_status, changed_by, note)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, [(new_id('osh'),) + tuple(row) for row in rows])
+
+def _transition_orders(cursor, order_ids, status, changed_by=None, note=None):
+    placeholders = ', '.join(['%s'] * len(order_ids))
+    cursor.execute(f"SELECT id, status, org_id FROM orders WHERE id IN ({placeholders}) FOR UPDATE", order_ids)
+    rows = {row['id']: row for row in cursor.fetchall()}
+    current = {order_id: row['status'] for order_id, row in rows.items()}
+
+    updated = []
+    rejected = []
+    for order_id in order_ids:
+        if order_id not in current:
+            rejected.append({'order_id': order_id, 'reason': 'Order not found'})
+        elif not _can_transition(current[order_id], status):
+            rejected.append({'order_id': order_id, 'reason': f"Cannot move from {current[order_id]} to {status}"})
+        else:
+            updated.append(order_id)
+
+    if updated:
+        placeholders = ', '.join(['%s'] * len(updated))
+        cursor.execute(f"UPDATE orders SET status = %s WHERE id IN ({placeholders})", [status] + updated)
+        _insert_history(cursor, [
+            (order_id, current[order_id], status, changed_by, note) for order_id in updated
+        ])
+    changes = [
+        (order_id, rows[order_id]['org_id'], current[order_id], status) for order_id in updated
+    ]
+    org_stats.apply_deltas([
+        delta for _, org_id, from_status, to_status in changes
+        for delta in [(org_id, org_stats.ORDERS, from_status, -1), (org_id, org_stats.ORDERS, to_status, 1)]
+    ], cursor)
+    return updated, rejected, changes
+
+def _order_months(cursor, order_ids):
+    # Bucketed by the stored created_at, exactly as rebuild_org_stats does, so app/DB clock skew can't split them
+    placeholders = ', '.join(['%s'] * len(order_ids))
+    cursor.execute(
+        f"SELECT id, DATE_FORMAT(created_at, '%%Y-%%m') AS month FROM orders WHERE id IN ({placeholders})", order_ids
+    )
+    return {row['id']: row['month'] for row in cursor.fetchall()}
+
+def _new_order_deltas(org_id, total_amount, month):
+    return [
+        (org_id, org_stats.ORDERS, 'pending', 1),
+        (org_id, org_stats.ORDER_VALUE, month, Decimal(str(total_amount)))
+    ]
+
+def _publish_status_changes(changes):
+    # Published only after commit so subscribers never see a rolled-back change
+    for order_id, org_id, from_status, to_status in changes:
+        broadcaster.publish('order_status', org_id, {
+            'order_id': order_id, 'from_status': from_status, 'to_status': to_status
+        })
+        if org_id:
+            roster.invalidate_roster(org_id)
+
+def _load_prices(cursor, items):
+    product_ids = list({item['product_id'] for item in items})
+    if not product_ids:
+        return {}
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    cursor.execute(f"SELECT id, price FROM products WHERE id IN ({placeholders})", product_ids)
+    return {row['id']: row['price'] for row in cursor.fetchall()}
+
+def _load_org_ids(cursor, user_ids):
+    user_ids = list({uid for uid in user_ids if uid})
+    if not user_ids:
+        return {}
+    placeholders = ', '.join(['%s'] * len(user_ids))
+    cursor.execute(f"SELECT id, org_id FROM org_users WHERE id IN ({placeholders})", user_ids)
+    return {row['id']: row['org_id'] for row in cursor.fetchall()}
+
+def _order_org_id(entry, user_type, org_ids):
+    if user_type != 'org_user':
+        return None
+    return org_ids.get(entry.get('org_user_id') or entry['user_id'])
+
+def _load_size_recommendations(cursor, product_ids, user_ids):
+    product_ids = list(set(product_ids))
+    user_ids = list(set(user_ids))
+    if not product_ids or not user_ids:
+        return {}
+    cursor.execute(f"""
+        SELECT product_id, user_id, size_label, measurement_id FROM size_recommendations
+        WHERE product_id IN ({', '.join(['%s'] * len(product_ids))})
+          AND user_id IN ({', '.join(['%s'] * len(user_ids))})
+    """, product_ids + user_ids)
+    return {(row['product_id'], row['user_id']): row for row in cursor.fetchall()}
+
+def _build_items(order_id, items, prices, recommendations=None, user_id=None):
+    rows = []
+    total = Decimal('0')
+    for item in items:
+        quantity = int(item.get('quantity', 1))
+        if quantity < 1:
+            raise ValueError(f"Invalid quantity for product {item['product_id']}")
+        unit_price = prices[item['product_id']]
+        total += unit_price * quantity
+        recommended = (recommendations or {}).get((item['product_id'], user_id), {})
+        rows.append((
+            new_id('oi'), order_id, item['product_id'], quantity, unit_price,
+            item.get('measurement_id', recommended.get('measurement_id')),
+            item.get('size_label', recommended.get('size_label'))
+        ))
+    return rows, total
+
+def _valid_items(items):
+    return isinstance(items, list) and items and all(
+        isinstance(item, dict) and 'product_id' in item for item in items
+    )
+
 @orders_bp.route('/create', methods=['POST'])
 def create_order():
     try:
         data = request.json
+        items = data.get('items')
+        if items is not None and not _valid_items(items):
+            return jsonify({'success': False, 'message': 'Items must be a non-empty list of products'}), 400
+
         conn = get_connection()
-        with conn.cursor() as cursor:
-            oid = str(uuid.uuid4())
-            cursor.execute("INSERT INTO orders (id, user_id, user_type, org_user_id, status, total_amount) VALUES (%s, %s, %s, %s, %s, %s)", 
-                           (oid, data['user_id'], data['user_type'], data.get('org_user_id'), 'pending', data['total_amount']))
-            conn.commit()
-        conn.close()
-        return jsonify({'success': True, 'order_id': oid})
+        try:
+            with conn.cursor() as cursor:
+                oid = new_id()
+                item_rows = []
+                total_amount = data.get('total_amount')
+                if items:
+                    prices = _load_prices(cursor, items)
+                    missing = [item['product_id'] for item in items if item['product_id'] not in prices]
+                    if missing:
+                        return jsonify({'success': False, 'message': 'Unknown products', 'missing': missing}), 400
+                    item_rows, total_amount = _build_items(oid, items, prices)
+
+                org_ids = _load_org_ids(cursor, [data.get('org_user_id') or data['user_id']]) if data['user_type'] == 'org_user' else {}
+                order_org_id = _order_org_id(data, data['user_type'], org_ids)
+                cursor.execute("INSERT INTO orders (id, user_id, user_type, org_user_id, org_id, status, total_amount) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                               (oid, data['user_id'], data['user_type'], data.get('org_user_id'),
+                                order_org_id, 'pending', total_amount))
+                if item_rows:
+                    cursor.executemany("""
+                        INSERT INTO order_items (id, order_id, product_id, quantity, unit_price, measurement_id, size_label)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    """, item_rows)
+                _insert_history(cursor, [(oid, None, 'pending', data.get('created_by'), None)])
+                month = _order_months(cursor, [oid])[oid]
+                org_stats.apply_deltas(_new_order_deltas(order_org_id, total_amount, month), cursor)
+                conn.commit()
+        except Exception:
+            # A statement stopped at its deadline can take the connection down with it
+            if conn.open:
+                conn.rollback()
+            raise
+        finally:
+            conn.close()
+        _publish_status_changes([(oid, order_org_id, None, 'pending')])
+        return jsonify({'success': True, 'order_id': oid, 'total_amount': str(total_amount)})
+    except StatementTimeout:
+        # Left to the app's handler, which answers 504 instead of this route's 200 error body
+        raise
     except Exception as e:
         return jsonify({'error': str(e)})
 
+@orders_bp.route('/bulk', methods=['POST'])
+def create_bulk_orders():
+    data = request.get_json()
+
+    if not data or not isinstance(data.get('orders'), list) or not data['orders']:
+        return jsonify({'success': False, 'message': 'Orders must be a non-empty list'}), 400
+
+    if len(data['orders']) > MAX_BULK_ORDERS:
+        return jsonify({'success': False, 'message': f'At most {MAX_BULK_ORDERS} orders per request'}), 400
+
+    user_type = data.get('user_type', 'org_user')
+    if user_type not in ['org_user', 'individual']:
+        return jsonify({'success': False, 'message': 'Invalid user type'}), 400
+
+    # Items at the top level are the uniform kit; an entry may override them with its own list
+    default_items = data.get('items')
+    entries = []
+    for entry in data['orders']:
+        items = entry.get('items', default_items)
+        if 'user_id' not in entry or not _valid_items(items):
+            return jsonify({'success': False, 'message': 'Each order needs a user_id and a non-empty items list'}), 400
+        entries.append((entry, items))
+
+    try:
+        conn = get_connection()
+        try:
+            with conn.cursor() as cursor:
+                prices = _load_prices(cursor, [item for _, items in entries for item in items])
+                missing = sorted({
+                    item['product_id'] for _, items in entries for item in items
+                    if item['product_id'] not in prices
+                })
+                if missing:
+                    return jsonify({'success': False, 'message': 'Unknown products', 'missing': missing}), 400
+
+                org_ids = {}
+                recommendations = {}
+                if user_type == 'org_user':
+                    member_ids = [entry.get('org_user_id') or entry['user_id'] for entry, _ in entries]
+                    org_ids = _load_org_ids(cursor, member_ids)
+                    # Sizes from the latest recommendation run fill in items that do not name one
+                    recommendations = _load_size_recommendations(
+                        cursor, [item['product_id'] for _, items in entries for item in items], member_ids
+                    )
+
+                order_rows = []
+                item_rows = []
+                created = []
+                for entry, items in entries:
+                    oid = new_id()
+                    rows, total = _build_items(
+                        oid, items, prices, recommendations, entry.get('org_user_id') or entry['user_id']
+                    )
+                    order_rows.append((
+                        oid, entry['user_id'], user_type, entry.get('org_user_id'),
+                        _order_org_id(entry, user_type, org_ids), 'pending', total
+                    ))
+                    item_rows.extend(rows)
+                    created.append({'order_id': oid, 'user_id': entry['user_id'], 'total_amount': str(total)})
+
+                # pymysql folds executemany INSERTs into multi-row statements
+                cursor.executemany("""
+                    INSERT INTO orders (id, user_id, user_type, org_user_id, org_id, status, total_amount)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """, order_rows)
+                cursor.executemany("""
+                    INSERT INTO order_items (id, order_id, product_id, quantity, unit_price, measurement_id, size_label)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """, item_rows)
+                _insert_history(cursor, [
+                    (row[0], None, 'pending', data.get('created_by'), None) for row in order_rows
+                ])
+                months = _order_months(cursor, [row[0] for row in order_rows])
+                org_stats.apply_deltas([
+                    delta for row in order_rows for delta in _new_order_deltas(row[4], row[6], months[row[0]])
+                ], cursor)
+                conn.commit()
+        except Exception:
+            if conn.open:
+                conn.rollback()
+            raise
+        finally:
+            conn.close()
+        _publish_status_changes([(row[0], row[4], None, 'pending') for row in order_rows])
+
+        return jsonify({'success': True, 'orders': created, 'count': len(created)})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@orders_bp.route('/list', methods=['GET'])
+def list_orders():
+    try:
+        limit = get_page_size(request.args.get('limit'))
+        # The keyset cursor is built from created_at and id, so both are always selected
+        columns = select_columns(ORDER_FIELDS, request.args.get('fields'), required=('id', 'created_at'))
+        conditions = []
+        params = []
+
+        # user_id, org_id and status each lead one of the (column, created_at) indexes
+        for field in ['user_id', 'org_id', 'status', 'user_type']:
+            if request.args.get(field):
+                conditions.append(f"{field} = %s")
+                params.append(request.args[field])
+
+        for arg, op in [('from', '>='), ('to', '<')]:
+            if request.args.get(arg):
+                conditions.append(f"created_at {op} %s")
+                params.append(datetime.fromisoformat(request.args[arg]))
+
+        if request.args.get('cursor'):
+            created_at, last_id = decode_cursor(request.args['cursor'])
+            conditions.append("(created_at < %s OR (created_at = %s AND id < %s))")
+            params.extend([created_at, created_at, last_id])
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        params.append(limit + 1)
+
+        conn = get_connection(read_only=True)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT {columns}
+                    FROM orders
+                    {where}
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                """, params)
+                rows = cursor.fetchall()
+        finally:
+            conn.close()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+
+        return jsonify({'success': True, 'orders': rows, 'next_cursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @orders_bp.route('/details/<order_id>', methods=['GET'])
 def get_order(order_id):
     try:
-        conn = get_connection()
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM orders WHERE id=%s", (order_id,))
-            result = cursor.fetchone()
-        conn.close()
+        columns = select_columns(ORDER_FIELDS, request.args.get('fields'))
+        conn = get_connection(read_only=True)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"SELECT {columns} FROM orders WHERE id=%s", (order_id,))
+                result = cursor.fetchone()
+                if result:
+                    cursor.execute("""
+                        SELECT oi.*, p.name as product_name
+                        FROM order_items oi
+                        LEFT JOIN products p ON oi.product_id = p.id
+                        WHERE oi.order_id = %s
+                    """, (order_id,))
+                    result['items'] = cursor.fetchall()
+        finally:
+            conn.close()
+        if not result:
+            # Old completed orders live in the archive files once they leave the hot table
+            archived = archive.load_archived('orders', order_id)
+            if archived:
+                fields = ['id'] + [f for f in parse_fields(request.args.get('fields'), ORDER_FIELDS) if f != 'id']
+                result = {field: archived['row'].get(field) for field in fields}
+                result['items'] = archived['items']
+                result['archived'] = True
         return jsonify(result if result else {})
+    except StatementTimeout:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)})
 
+@orders_bp.route('/history/<order_id>', methods=['GET'])
+def get_order_history(order_id):
+    try:
+        conn = get_connection(read_only=True)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT id, from_status, to_status, changed_by, note, created_at
+                    FROM order_status_history
+                    WHERE order_id = %s
+                    ORDER BY created_at, id
+                """, (order_id,))
+                history = cursor.fetchall()
+        finally:
+            conn.close()
+        if not history:
+            archived = archive.load_archived('orders', order_id)
+            if archived:
+                history = [
+                    {key: entry[key] for key in ('id', 'from_status', 'to_status', 'changed_by', 'note', 'created_at')}
+                    for entry in archived['history']
+                ]
+        return jsonify({'success': True, 'history': history})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @orders_bp.route('/update_status', methods=['POST'])
 def update_status():
     try:
         data = request.json
         conn = get_connection()
-        with conn.cursor() as cursor:
-            cursor.execute("UPDATE orders SET status=%s WHERE id=%s", (data['status'], data['order_id']))
-            conn.commit()
-        conn.close()
+        try:
+            with conn.cursor() as cursor:
+                updated, rejected, changes = _transition_orders(
+                    cursor, [data['order_id']], data['status'], data.get('changed_by'), data.get('note')
+                )
+                conn.commit()
+        except Exception:
+            if conn.open:
+                conn.rollback()
+            raise
+        finally:
+            conn.close()
+        _publish_status_changes(changes)
+        if rejected:
+            status_code = 404 if rejected[0]['reason'] == 'Order not found' else 409
+            return jsonify({'success': False, 'message': rejected[0]['reason']}), status_code
         return jsonify({'success': True})
+    except StatementTimeout:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)})
+
+@orders_bp.route('/bulk_update_status', methods=['POST'])
+def bulk_update_status():
+    data = request.get_json()
+
+    if not data or 'status' not in data or not isinstance(data.get('order_ids'), list) or not data['order_ids']:
+        return jsonify({'success': False, 'message': 'Missing status or order_ids'}), 400
+
+    if len(data['order_ids']) > MAX_BULK_STATUS_UPDATES:
+        return jsonify({'success': False, 'message': f'At most {MAX_BULK_STATUS_UPDATES} orders per request'}), 400
+
+    if data['status'] not in ORDER_STATUS_FLOW + [CANCELLED]:
+        return jsonify({'success': False, 'message': 'Invalid status'}), 400
+
+    try:
+        order_ids = list(dict.fromkeys(data['order_ids']))
+        conn = get_connection()
+        try:
+            with conn.cursor() as cursor:
+                updated, rejected, changes = _transition_orders(
+                    cursor, order_ids, data['status'], data.get('changed_by'), data.get('note')
+                )
+                conn.commit()
+        except Exception:
+            if conn.open:
+                conn.rollback()
+            raise
+        finally:
+            conn.close()
+        _publish_status_changes(changes)
+
+        return jsonify({'success': True, 'updated': updated, 'rejected': rejected})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
@@ -1,16 +1,34 @@
-import uuid
 from flask import Blueprint, request, jsonify
-from db import execute_query
+from db import execute_query, get_connection
+from ids import new_id
+from units import parse_measurement, load_field_units
+from size_recommendation import get_size_chart, run_size_recommendations
+from sync import parse_since, current_sync_cursor, record_tombstone, get_tombstones
+import jobs
+from projection import select_columns
+from batch import get_batch_ids, placeholders, key_by_id
 
 products = Blueprint('products', __name__, url_prefix='/api/products')
 
+CATEGORY_FIELDS = {
+    'id': 'id', 'name': 'name', 'description': 'description', 'created_at': 'created_at', 'updated_at': 'updated_at',
+}
+PRODUCT_FIELDS = {
+    'id': 'p.id', 'name': 'p.name', 'category_id': 'p.category_id', 'description': 'p.description',
+    'price': 'p.price', 'image': 'p.image', 'created_at': 'p.created_at', 'updated_at': 'p.updated_at',
+    'category_name': 'pc.name',
+}
+
 @products.route('/categories', methods=['GET'])
 def get_product_categories():
     try:
-        query = "SELECT * FROM product_categories"
+        columns = select_columns(CATEGORY_FIELDS, request.args.get('fields'))
+        query = f"SELECT {columns} FROM product_categories"
         result = execute_query(query)
         
         return jsonify({'success': True, 'categories': result})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -22,7 +40,7 @@ def add_product_category():
         return jsonify({'success': False, 'message': 'Missing name field'}), 400
     
     try:
-        category_id = f"pc-{uuid.uuid4().hex[:8]}"
+        category_id = new_id('pc')
         query = "INSERT INTO product_categories (id, name, description) VALUES (%s, %s, %s)"
         execute_query(query, (category_id, data['name'], data.get('description')), fetch=False)
         
@@ -33,22 +51,36 @@ def add_product_category():
 @products.route('/', methods=['GET'])
 def get_products():
     try:
-        query = """
-            SELECT p.*, pc.name as category_name 
+        since = parse_since(request.args.get('since'))
+        cursor = current_sync_cursor(since)
+        
+        columns = select_columns(PRODUCT_FIELDS, request.args.get('fields'))
+        query = f"""
+            SELECT {columns}
             FROM products p
             JOIN product_categories pc ON p.category_id = pc.id
         """
-        result = execute_query(query)
+        params = None
+        if since:
+            query += " WHERE p.updated_at >= %s"
+            params = (since,)
+        result = execute_query(query, params)
         
-        return jsonify({'success': True, 'products': result})
+        response = {'success': True, 'products': result, 'sync_cursor': cursor}
+        if since:
+            response['deleted'] = get_tombstones('products', since)
+        return jsonify(response)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @products.route('/<product_id>', methods=['GET'])
 def get_product(product_id):
     try:
-        query = """
-            SELECT p.*, pc.name as category_name 
+        columns = select_columns(PRODUCT_FIELDS, request.args.get('fields'))
+        query = f"""
+            SELECT {columns}
             FROM products p
             JOIN product_categories pc ON p.category_id = pc.id
             WHERE p.id = %s
@@ -59,14 +91,36 @@ def get_product(product_id):
             return jsonify({'success': False, 'message': 'Product not found'}), 404
         
         return jsonify({'success': True, 'product': result[0]})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@products.route('/batch', methods=['GET', 'POST'])
+def get_products_batch():
+    try:
+        ids = get_batch_ids(request)
+        columns = select_columns(PRODUCT_FIELDS, request.args.get('fields'))
+        query = f"""
+            SELECT {columns}
+            FROM products p
+            JOIN product_categories pc ON p.category_id = pc.id
+            WHERE p.id IN ({placeholders(ids)})
+        """
+        found, missing = key_by_id(execute_query(query, ids), ids)
+        
+        return jsonify({'success': True, 'products': found, 'missing': missing})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @products.route('/category/<category_id>', methods=['GET'])
 def get_products_by_category(category_id):
     try:
-        query = """
-            SELECT p.*, pc.name as category_name 
+        columns = select_columns(PRODUCT_FIELDS, request.args.get('fields'))
+        query = f"""
+            SELECT {columns}
             FROM products p
             JOIN product_categories pc ON p.category_id = pc.id
             WHERE p.category_id = %s
@@ -74,6 +128,8 @@ def get_products_by_category(category_id):
         result = execute_query(query, (category_id,))
         
         return jsonify({'success': True, 'products': result})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -85,7 +141,7 @@ def add_product():
         return jsonify({'success': False, 'message': 'Missing required fields'}), 400
     
     try:
-        product_id = f"p-{uuid.uuid4().hex[:8]}"
+        product_id = new_id('p')
         query = """
             INSERT INTO      (id, name, category_id, description, price, image)
             VALUES (%s, %s, %s, %s, %s, %s)
@@ -132,7 +188,110 @@ def delete_product(product_id):
     try:
         query = "DELETE FROM products WHERE id = %s"
         execute_query(query, (product_id,), fetch=False)
+        record_tombstone('products', product_id)
         
         return jsonify({'success': True, 'message': 'Product deleted successfully'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@products.route('/<product_id>/size_chart', methods=['GET'])
+def get_product_size_chart(product_id):
+    try:
+        sizes = {}
+        for row in get_size_chart(product_id):
+            size = sizes.setdefault(row['id'], {
+                'id': row['id'],
+                'label': row['label'],
+                'measurement_type_id': row['measurement_type_id'],
+                'values': []
+            })
+            if row['field_id']:
+                size['values'].append({
+                    'field_id': row['field_id'],
+                    'value': row['value_numeric'],
+                    'weight': row['weight']
+                })
+        
+        return jsonify({'success': True, 'unit': 'cm', 'sizes': list(sizes.values())})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@products.route('/<product_id>/size_chart', methods=['PUT'])
+def set_product_size_chart(product_id):
+    data = request.get_json()
+    
+    if not data or 'measurement_type_id' not in data or not isinstance(data.get('sizes'), list):
+        return jsonify({'success': False, 'message': 'Missing measurement_type_id or sizes'}), 400
+    
+    if not all('label' in size and isinstance(size.get('values', []), list) for size in data['sizes']):
+        return jsonify({'success': False, 'message': 'Each size needs a label and a list of values'}), 400
+    
+    try:
+        units = load_field_units([
+            value['field_id'] for size in data['sizes'] for value in size.get('values', []) if 'field_id' in value
+        ])
+        size_rows = []
+        value_rows = []
+        for order, size in enumerate(data['sizes']):
+            size_id = new_id('ps')
+            size_rows.append((size_id, product_id, data['measurement_type_id'], size['label'], order))
+            for value in size.get('values', []):
+                numeric = parse_measurement(value.get('value'), units.get(value.get('field_id')))
+                if numeric is None:
+                    return jsonify({'success': False, 'message': f"Invalid value for size {size['label']}"}), 400
+                value_rows.append((size_id, value['field_id'], numeric, value.get('weight', 1)))
+        
+        # The chart is replaced as a whole so readers never see a half-written set of sizes
+        conn = get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM product_sizes WHERE product_id = %s", (product_id,))
+                if size_rows:
+                    cursor.executemany("""
+                        INSERT INTO product_sizes (id, product_id, measurement_type_id, label, display_order)
+                        VALUES (%s, %s, %s, %s, %s)
+                    """, size_rows)
+                if value_rows:
+                    cursor.executemany("""
+                        INSERT INTO product_size_values (size_id, field_id, value_numeric, weight)
+                        VALUES (%s, %s, %s, %s)
+                    """, value_rows)
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        return jsonify({'success': True, 'message': 'Size chart saved successfully'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@products.route('/<product_id>/size_recommendations/<org_id>', methods=['GET'])
+def get_size_recommendations(product_id, org_id):
+    try:
+        query = """
+            SELECT sr.user_id, ou.name as user_name, ou.department, sr.size_id, sr.size_label,
+                   sr.measurement_id, sr.distance, sr.created_at
+            FROM size_recommendations sr
+            JOIN org_users ou ON sr.user_id = ou.id
+            WHERE sr.org_id = %s AND sr.product_id = %s
+        """
+        result = execute_query(query, (org_id, product_id))
+        
+        return jsonify({'success': True, 'recommendations': result})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@products.route('/<product_id>/size_recommendations/<org_id>', methods=['POST'])
+def compute_size_recommendations(product_id, org_id):
+    try:
+        if request.args.get('background') == 'true':
+            job_id = jobs.submit('size_recommendations', {'product_id': product_id, 'org_id': org_id})
+            return jsonify({'success': True, 'job_id': job_id}), 202
+        
+        recommendations = run_size_recommendations(product_id, org_id)
+        
+        return jsonify({'success': True, 'recommendations': recommendations, 'count': len(recommendations)})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
\ No newline at end of file
@@ -0,0 +1,28 @@
+from flask import Blueprint, request, jsonify, Response
+from profiler import sampler, is_authorized
+
+profiling = Blueprint('profiling', __name__, url_prefix='/api/admin/profiles')
+
+@profiling.before_request
+def require_token():
+    # Profiles expose code paths, so they are only served to holders of the profiling token
+    if not is_authorized(request):
+        return jsonify({'success': False, 'message': 'Resource not found'}), 404
+
+@profiling.route('', methods=['GET'])
+def list_profiles():
+    return jsonify({'success': True, 'profiles': sampler.summary()})
+
+@profiling.route('/<endpoint>', methods=['GET'])
+def get_profile(endpoint):
+    folded = sampler.folded(endpoint)
+    if not folded:
+        return jsonify({'success': False, 'message': 'No samples for this endpoint'}), 404
+    
+    # Folded stacks, ready for flamegraph.pl or speedscope
+    return Response(folded, mimetype='text/plain')
+
+@profiling.route('', methods=['DELETE'])
+def reset_profiles():
+    sampler.reset(request.args.get('endpoint'))
+    return jsonify({'success': True, 'message': 'Profiles cleared'})
@@ -0,0 +1,25 @@
+import logging
+from flask import Blueprint, request, jsonify, send_file
+from reports import fetch_sheet_data, build_sheet_archive
+
+reports = Blueprint('reports', __name__, url_prefix='/api/reports')
+
+@reports.route('/org/<org_id>/measurement_sheets', methods=['GET'])
+def get_measurement_sheets(org_id):
+    try:
+        data = fetch_sheet_data(org_id, request.args.get('type_id'))
+        
+        if data is None:
+            return jsonify({'success': False, 'message': 'Organization not found'}), 404
+        
+        archive = build_sheet_archive(data)
+        
+        return send_file(
+            archive,
+            mimetype='application/zip',
+            as_attachment=True,
+            download_name=f"measurement_sheets_{org_id}.zip"
+        )
+    except Exception as e:
+        logging.error(f"Measurement sheets error: {str(e)}")
+        return jsonify({'success': False, 'message': 'Failed to generate measurement sheets'}), 500
@@ -0,0 +1,27 @@
+import logging
+from flask import Blueprint, request, jsonify
+import org_stats
+import jobs
+
+stats = Blueprint('stats', __name__, url_prefix='/api/stats')
+
+@stats.route('/org/<org_id>', methods=['GET'])
+def get_org_stats(org_id):
+    try:
+        return jsonify({'success': True, 'stats': org_stats.get_org_stats(org_id)})
+    except Exception as e:
+        logging.error(f"Get org stats error: {str(e)}")
+        return jsonify({'success': False, 'message': 'Failed to fetch organization stats'}), 500
+
+@stats.route('/org/<org_id>/reconcile', methods=['POST'])
+def reconcile_org_stats(org_id):
+    try:
+        if request.args.get('background') == 'true':
+            job_id = jobs.submit('rebuild_org_stats', {'org_id': org_id})
+            return jsonify({'success': True, 'job_id': job_id}), 202
+        
+        org_stats.rebuild_org_stats(org_id)
+        return jsonify({'success': True, 'stats': org_stats.get_org_stats(org_id)})
+    except Exception as e:
+        logging.error(f"Reconcile org stats error: {str(e)}")
+        return jsonify({'success': False, 'message': 'Failed to reconcile organization stats'}), 500
@@ -1,10 +1,51 @@
-import uuid
 import logging
 from flask import Blueprint, request, jsonify
-from db import execute_query
+from db import execute_query, execute_rows
+from ids import new_id
+from sync import parse_since, current_sync_cursor, record_tombstone, get_tombstones
+import org_stats
+import jobs
+import deletion
+from projection import select_columns
+from batch import get_batch_ids, placeholders, key_by_id
+from rows import parse_layout
+from pagination import get_page_size
+import roster
+from config import Config
 
 users = Blueprint('users', __name__, url_prefix='/api/users')
 
+# Fields each list endpoint may return; passwords are never selectable
+SUPER_ADMIN_FIELDS = {
+    'id': 'id', 'name': 'name', 'email': 'email', 'created_at': 'created_at', 'updated_at': 'updated_at',
+}
+ORG_ADMIN_FIELDS = {
+    'id': 'oa.id', 'org_id': 'oa.org_id', 'name': 'oa.name', 'email': 'oa.email',
+    'is_first_login': 'oa.is_first_login', 'created_at': 'oa.created_at', 'updated_at': 'oa.updated_at',
+    'org_name': 'o.name',
+}
+ORG_USER_FIELDS = {
+    'id': 'ou.id', 'org_id': 'ou.org_id', 'name': 'ou.name', 'email': 'ou.email', 'phone': 'ou.phone',
+    'address': 'ou.address', 'age': 'ou.age', 'department': 'ou.department', 'created_by': 'ou.created_by',
+    'created_at': 'ou.created_at', 'updated_at': 'ou.updated_at', 'org_name': 'o.name',
+}
+INDIVIDUAL_FIELDS = {
+    'id': 'id', 'name': 'name', 'email': 'email', 'phone': 'phone', 'address': 'address', 'age': 'age',
+    'created_at': 'created_at', 'updated_at': 'updated_at',
+}
+
+def _org_user_stat_deltas(user_id, org_id, sign):
+    # An org user carries their measurements with them in the org rollup
+    query = """
+        SELECT measurement_type_id, COUNT(*) AS total FROM measurements
+        WHERE user_id = %s AND user_type = 'org_user'
+        GROUP BY measurement_type_id
+    """
+    deltas = [(org_id, org_stats.USERS, '', sign)]
+    for row in execute_query(query, (user_id,)):
+        deltas.append((org_id, org_stats.MEASUREMENTS, row['measurement_type_id'], sign * row['total']))
+    return deltas
+
 @users.route('/super_admin', methods=['POST'])
 def create_super_admin():
     try:
@@ -13,7 +54,7 @@ def create_super_admin():
         if not data or not all(key in data for key in ['name', 'email', 'password']):
             return jsonify({'success': False, 'message': 'Missing required fields'}), 400
         
-        admin_id = f"sa-{uuid.uuid4().hex[:8]}"
+        admin_id = new_id('sa')
         query = """
             INSERT INTO super_admins (id, name, email, password, is_first_login)
             VALUES (%s, %s, %s, %s, %s)
@@ -73,11 +114,14 @@ def delete_super_admin(admin_id):
 @users.route('/super_admin/all', methods=['GET'])
 def get_all_super_admins():
     try:
-        query = "SELECT id, name, email, created_at, updated_at FROM super_admins"
+        columns = select_columns(SUPER_ADMIN_FIELDS, request.args.get('fields'))
+        query = f"SELECT {columns} FROM super_admins"
         result = execute_query(query)
         
         return jsonify({'success': True, 'admins': result})
         
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         logging.error(f"Get super admins error: {str(e)}")
         return jsonify({'success': False, 'message': 'Failed to fetch super admins'}), 500
@@ -90,7 +134,7 @@ def create_organization():
         if not data or not all(key in data for key in ['name', 'pan', 'email', 'phone', 'address', 'gstin', 'created_by']):
             return jsonify({'success': False, 'message': 'Missing required fields'}), 400
         
-        org_id = f"org-{uuid.uuid4().hex[:8]}"
+        org_id = new_id('org')
         query = """
             INSERT INTO organizations (id, name, pan, email, phone, address, gstin, logo, created_by)
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
@@ -106,6 +150,22 @@ def create_organization():
         logging.error(f"Create organization error: {str(e)}")
         return jsonify({'success': False, 'message': 'Failed to create organization'}), 500
 
+@users.route('/organization/<org_id>', methods=['DELETE'])
+def delete_organization(org_id):
+    try:
+        existing = execute_query("SELECT id FROM organizations WHERE id = %s", (org_id,))
+        
+        if not existing:
+            return jsonify({'success': False, 'message': 'Organization not found'}), 404
+        
+        job_id = jobs.submit('delete_organization', {'org_id': org_id})
+        
+        return jsonify({'success': True, 'job_id': job_id, 'message': 'Organization deletion started'}), 202
+        
+    except Exception as e:
+        logging.error(f"Delete organization error: {str(e)}")
+        return jsonify({'success': False, 'message': 'Failed to delete organization'}), 500
+
 @users.route('/org_admin', methods=['POST'])
 def create_org_admin():
     try:
@@ -114,7 +174,7 @@ def create_org_admin():
         if not data or not all(key in data for key in ['org_id', 'name', 'email', 'password']):
             return jsonify({'success': False, 'message': 'Missing required fields'}), 400
         
-        admin_id = f"oa-{uuid.uuid4().hex[:8]}"
+        admin_id = new_id('oa')
         query = """
             INSERT INTO org_admins (id, org_id, name, email, password, is_first_login)
             VALUES (%s, %s, %s, %s, %s, %s)
@@ -176,8 +236,9 @@ def delete_org_admin(admin_id):
 @users.route('/org_admin/all', methods=['GET'])
 def get_all_org_admins():
     try:
-        query = """
-            SELECT oa.*, o.name as org_name 
+        columns = select_columns(ORG_ADMIN_FIELDS, request.args.get('fields'))
+        query = f"""
+            SELECT {columns}
             FROM org_admins oa 
             JOIN organizations o ON oa.org_id = o.id
         """
@@ -185,6 +246,8 @@ def get_all_org_admins():
         
         return jsonify({'success': True, 'admins': result})
         
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         logging.error(f"Get org admins error: {str(e)}")
         return jsonify({'success': False, 'message': 'Failed to fetch organization admins'}), 500
@@ -192,11 +255,19 @@ def get_all_org_admins():
 @users.route('/org_admin/by_org/<org_id>', methods=['GET'])
 def get_org_admins_by_org(org_id):
     try:
-        query = "SELECT * FROM org_admins WHERE org_id = %s"
+        columns = select_columns(ORG_ADMIN_FIELDS, request.args.get('fields'))
+        query = f"""
+            SELECT {columns}
+            FROM org_admins oa
+            JOIN organizations o ON oa.org_id = o.id
+            WHERE oa.org_id = %s
+        """
         result = execute_query(query, (org_id,))
         
         return jsonify({'success': True, 'admins': result})
         
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         logging.error(f"Get org admins by org error: {str(e)}")
         return jsonify({'success': False, 'message': 'Failed to fetch organization admins'}), 500
@@ -211,7 +282,7 @@ def create_org_user():
         ]):
             return jsonify({'success': False, 'message': 'Missing required fields'}), 400
         
-        user_id = f"ou-{uuid.uuid4().hex[:8]}"
+        user_id = new_id('ou')
         query = """
             INSERT INTO org_users (id, org_id, name, email, phone, address, age, department, created_by)
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
@@ -221,6 +292,9 @@ def create_org_user():
             data['address'], data.get('age'), data.get('department'), data['created_by']
         ), fetch=False)
         
+        org_stats.apply_deltas([(data['org_id'], org_stats.USERS, '', 1)])
+        roster.invalidate_roster(data['org_id'])
+        
         return jsonify({'success': True, 'id': user_id, 'message': 'Organization user created successfully'})
         
     except Exception as e:
@@ -249,9 +323,23 @@ def modify_org_user(user_id):
         if not update_fields:
             return jsonify({'success': False, 'message': 'No valid fields to update'}), 400
         
+        previous = execute_query("SELECT org_id FROM org_users WHERE id = %s", (user_id,))
+        
         params.append(user_id)
         query = f"UPDATE org_users SET {', '.join(update_fields)} WHERE id = %s"
         execute_query(query, params, fetch=False)
+        # A move changes the roster of the org the user left as well as the one they joined
+        org_ids = {row['org_id'] for row in previous}
+        if 'org_id' in data:
+            org_ids.add(data['org_id'])
+        for org_id in org_ids:
+            roster.invalidate_roster(org_id)
+        
+        if 'org_id' in data and previous and previous[0]['org_id'] != data['org_id']:
+            org_stats.apply_deltas(
+                _org_user_stat_deltas(user_id, previous[0]['org_id'], -1) +
+                _org_user_stat_deltas(user_id, data['org_id'], 1)
+            )
         
         return jsonify({'success': True, 'message': 'Organization user updated successfully'})
         
@@ -262,9 +350,21 @@ def modify_org_user(user_id):
 @users.route('/org_user/<user_id>', methods=['DELETE'])
 def delete_org_user(user_id):
     try:
+        existing = execute_query("SELECT org_id FROM org_users WHERE id = %s", (user_id,))
+        
         query = "DELETE FROM org_users WHERE id = %s"
         execute_query(query, (user_id,), fetch=False)
         
+        if existing:
+            record_tombstone('org_users', user_id, org_id=existing[0]['org_id'])
+            org_stats.apply_deltas(_org_user_stat_deltas(user_id, existing[0]['org_id'], -1))
+            roster.invalidate_roster(existing[0]['org_id'])
+            # Measurements and orders are removed in the background in small chunks
+            job_id = jobs.submit('delete_user_data', {
+                'user_id': user_id, 'user_type': 'org_user', 'org_id': existing[0]['org_id']
+            })
+            return jsonify({'success': True, 'job_id': job_id, 'message': 'Organization user deleted successfully'})
+        
         return jsonify({'success': True, 'message': 'Organization user deleted successfully'})
         
     except Exception as e:
@@ -274,31 +374,101 @@ def delete_org_user(user_id):
 @users.route('/org_user/all', methods=['GET'])
 def get_all_org_users():
     try:
-        query = """
-            SELECT ou.*, o.name as org_name 
+        since = parse_since(request.args.get('since'))
+        cursor = current_sync_cursor(since)
+        
+        columns = select_columns(ORG_USER_FIELDS, request.args.get('fields'))
+        query = f"""
+            SELECT {columns}
             FROM org_users ou 
             JOIN organizations o ON ou.org_id = o.id
         """
-        result = execute_query(query)
-        
-        return jsonify({'success': True, 'users': result})
-        
+        params = None
+        if since:
+            query += " WHERE ou.updated_at >= %s"
+            params = (since,)
+        layout = parse_layout(request.args.get('layout'))
+        result = execute_rows(query, params)
+        
+        extra = {'success': True, 'sync_cursor': cursor}
+        if since:
+            extra['deleted'] = get_tombstones('org_users', since)
+        return result.json_response('users', layout, **extra)
+        
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         logging.error(f"Get org users error: {str(e)}")
         return jsonify({'success': False, 'message': 'Failed to fetch organization users'}), 500
 
+@users.route('/organization/<org_id>/roster', methods=['GET'])
+def get_org_roster(org_id):
+    try:
+        limit = get_page_size(request.args.get('limit'))
+        result = roster.get_roster(org_id, limit, request.args.get('cursor'))
+        
+        response = jsonify({'success': True, **result})
+        response.headers['Cache-Control'] = f'private, max-age={Config.ROSTER_CACHE_SECONDS}'
+        response.add_etag()
+        return response.make_conditional(request)
+        
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Get org roster error: {str(e)}")
+        return jsonify({'success': False, 'message': 'Failed to fetch organization roster'}), 500
+
 @users.route('/org_user/by_org/<org_id>', methods=['GET'])
 def get_org_users_by_org(org_id):
     try:
-        query = "SELECT * FROM org_users WHERE org_id = %s"
-        result = execute_query(query, (org_id,))
-        
-        return jsonify({'success': True, 'users': result})
+        since = parse_since(request.args.get('since'))
+        cursor = current_sync_cursor(since)
         
+        columns = select_columns(ORG_USER_FIELDS, request.args.get('fields'))
+        query = f"""
+            SELECT {columns}
+            FROM org_users ou
+            JOIN organizations o ON ou.org_id = o.id
+            WHERE ou.org_id = %s
+        """
+        params = [org_id]
+        if since:
+            query += " AND ou.updated_at >= %s"
+            params.append(since)
+        result = execute_query(query, params)
+        
+        response = {'success': True, 'users': result, 'sync_cursor': cursor}
+        if since:
+            response['deleted'] = get_tombstones('org_users', since, org_id=org_id)
+        return jsonify(response)
+        
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         logging.error(f"Get org users by org error: {str(e)}")
         return jsonify({'success': False, 'message': 'Failed to fetch organization users'}), 500
 
+@users.route('/org_user/batch', methods=['GET', 'POST'])
+def get_org_users_batch():
+    try:
+        ids = get_batch_ids(request)
+        columns = select_columns(ORG_USER_FIELDS, request.args.get('fields'))
+        query = f"""
+            SELECT {columns}
+            FROM org_users ou
+            JOIN organizations o ON ou.org_id = o.id
+            WHERE ou.id IN ({placeholders(ids)})
+        """
+        found, missing = key_by_id(execute_query(query, ids), ids)
+        
+        return jsonify({'success': True, 'users': found, 'missing': missing})
+        
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Get org users batch error: {str(e)}")
+        return jsonify({'success': False, 'message': 'Failed to fetch organization users'}), 500
+
 @users.route('/individual', methods=['POST'])
 def create_individual():
     try:
@@ -307,7 +477,7 @@ def create_individual():
         if not data or not all(key in data for key in ['name', 'email', 'password', 'phone', 'address']):
             return jsonify({'success': False, 'message': 'Missing required fields'}), 400
         
-        user_id = f"ind-{uuid.uuid4().hex[:8]}"
+        user_id = new_id('ind')
         query = """
             INSERT INTO individuals (id, name, email, password, phone, address, age)
             VALUES (%s, %s, %s, %s, %s, %s, %s)
@@ -361,7 +531,9 @@ def delete_individual(user_id):
         query = "DELETE FROM individuals WHERE id = %s"
         execute_query(query, (user_id,), fetch=False)
         
-        return jsonify({'success': True, 'message': 'Individual user deleted successfully'})
+        job_id = jobs.submit('delete_user_data', {'user_id': user_id, 'user_type': 'individual'})
+        
+        return jsonify({'success': True, 'job_id': job_id, 'message': 'Individual user deleted successfully'})
         
     except Exception as e:
         logging.error(f"Delete individual error: {str(e)}")
@@ -370,11 +542,30 @@ def delete_individual(user_id):
 @users.route('/individual/all', methods=['GET'])
 def get_all_individuals():
     try:
-        query = "SELECT id, name, email, phone, address, age, created_at, updated_at FROM individuals"
+        columns = select_columns(INDIVIDUAL_FIELDS, request.args.get('fields'))
+        query = f"SELECT {columns} FROM individuals"
         result = execute_query(query)
         
         return jsonify({'success': True, 'users': result})
         
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         logging.error(f"Get individuals error: {str(e)}")
+        return jsonify({'success': False, 'message': 'Failed to fetch individual users'}), 500
+
+@users.route('/individual/batch', methods=['GET', 'POST'])
+def get_individuals_batch():
+    try:
+        ids = get_batch_ids(request)
+        columns = select_columns(INDIVIDUAL_FIELDS, request.args.get('fields'))
+        query = f"SELECT {columns} FROM individuals WHERE id IN ({placeholders(ids)})"
+        found, missing = key_by_id(execute_query(query, ids), ids)
+        
+        return jsonify({'success': True, 'users': found, 'missing': missing})
+        
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Get individuals batch error: {str(e)}")
         return jsonify({'success': False, 'message': 'Failed to fetch individual users'}), 500
\ No newline at end of file
@@ -0,0 +1,62 @@
+import json
+import queue
+import threading
+from collections import deque
+from config import Config
+
+class Subscription:
+    def __init__(self, org_id, queue_size):
+        self.org_id = org_id
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def matches(self, event):
+        return self.org_id is None or event['org_id'] == self.org_id
+
+class Broadcaster:
+    """In-process fan-out of change events with a replay buffer for resuming clients."""
+
+    def __init__(self, queue_size=Config.EVENT_QUEUE_SIZE, history_size=Config.EVENT_HISTORY_SIZE):
+        self._lock = threading.Lock()
+        self._queue_size = queue_size
+        self._history = deque(maxlen=history_size)
+        self._subscribers = set()
+        self._next_id = 1
+
+    def publish(self, event_type, org_id, data):
+        with self._lock:
+            event = {'id': self._next_id, 'type': event_type, 'org_id': org_id, 'data': data}
+            self._next_id += 1
+            self._history.append(event)
+            for subscription in self._subscribers:
+                if subscription.overflowed or not subscription.matches(event):
+                    continue
+                try:
+                    subscription.queue.put_nowait(event)
+                except queue.Full:
+                    # A slow client is cut off and resumes from the replay buffer on reconnect
+                    subscription.overflowed = True
+        return event['id']
+
+    def subscribe(self, org_id=None, last_event_id=None):
+        subscription = Subscription(org_id, self._queue_size)
+        with self._lock:
+            replay = []
+            needs_reset = False
+            if last_event_id is not None:
+                oldest = self._history[0]['id'] if self._history else self._next_id
+                # An id we have not issued yet means this process restarted since the client's last event
+                needs_reset = last_event_id + 1 < oldest or last_event_id >= self._next_id
+                replay = [e for e in self._history if e['id'] > last_event_id and subscription.matches(e)]
+            self._subscribers.add(subscription)
+        return subscription, replay, needs_reset
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+def format_sse(event):
+    payload = json.dumps(event['data'], default=str)
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {payload}\n\n"
+
+broadcaster = Broadcaster()
@@ -6,4 +6,59 @@ class Config:
     MYSQL_USER = 'root'
     MYSQL_PASSWORD = 'root'
     MYSQL_DB = 'NandhaGarmentsDB'
-    LOG_FILE = 'logs/app.log'
\ No newline at end of file
+    MYSQL_PORT = int(os.environ.get('MYSQL_PORT', 3306))
+    # Comma-separated host[:port] list, e.g. MYSQL_REPLICAS=127.0.0.1:3307,127.0.0.1:3308
+    MYSQL_REPLICAS = [host for host in os.environ.get('MYSQL_REPLICAS', '').split(',') if host]
+    REPLICA_MAX_LAG_SECONDS = 5
+    REPLICA_CHECK_INTERVAL_SECONDS = 10
+    REPLICA_CONNECT_TIMEOUT_SECONDS = 1
+    # A client that wrote within this window reads from the primary: the most a replica can fall behind
+    # before the next health check takes it out
+    READ_YOUR_WRITES_SECONDS = REPLICA_MAX_LAG_SECONDS + REPLICA_CHECK_INTERVAL_SECONDS
+    LOG_FILE = 'logs/app.log'
+    LOG_MAX_BYTES = 10 * 1024 * 1024
+    LOG_BACKUP_COUNT = 10
+    EVENT_QUEUE_SIZE = 256
+    EVENT_HISTORY_SIZE = 5000
+    EVENT_HEARTBEAT_SECONDS = 15
+    DELETE_CHUNK_SIZE = 500
+    DELETE_THROTTLE_SECONDS = 0.05
+    JOB_WORKERS = 2
+    JOB_POLL_SECONDS = 2
+    JOB_MAX_ATTEMPTS = 3
+    # A running job whose heartbeat is older than this is presumed lost with its worker and claimed again
+    JOB_LEASE_SECONDS = 300
+    REPORT_WORKERS = 4
+    # Roughly the number of MySQL connections the app may hold at once
+    ADMISSION_CAPACITY = 32
+    ADMISSION_RESERVED_FOR_LIGHT = 8
+    ADMISSION_HEAVY_LIMIT = 4
+    ADMISSION_WAIT_SECONDS = {'light': 2.0, 'normal': 1.0, 'heavy': 0.25}
+    ADMISSION_RETRY_AFTER_SECONDS = 2
+    CLIENT_RATE_PER_SECOND = 20
+    CLIENT_BURST = 40
+    # Number of reverse proxies in front of the app whose X-Forwarded-For is trusted; 0 trusts none
+    TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', 0))
+    STATEMENT_DEADLINE_SECONDS = 10
+    # Routes that legitimately scan more get longer statement deadlines
+    STATEMENT_DEADLINES = {
+        'orders.list_orders': 15,
+        'measurements.get_all_measurements': 20,
+        'measurements.get_org_measurements': 20,
+        'measurements.get_size_analytics': 20,
+        'products.compute_size_recommendations': 30,
+        'reports.get_measurement_sheets': 60,
+        'stats.reconcile_org_stats': 60,
+    }
+    # Fraction of requests profiled at random; requests carrying X-Profile: <PROFILE_TOKEN> always are
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+    PROFILE_INTERVAL_SECONDS = 0.005
+    PROFILE_MAX_STACKS = 5000
+    MAX_HISTOGRAM_BINS = 200
+    ROSTER_CACHE_SECONDS = 30
+    ROSTER_CACHE_SIZE = 500
+    # Absolute, so the web process and the job workers find the same files whatever their working directory
+    ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive')
+    ARCHIVE_AFTER_DAYS = 365
+    ARCHIVE_CHUNK_SIZE = 500
@@ -1,18 +1,207 @@
+import random
+import threading
+import time
 import pymysql
+from flask import g, has_request_context, request
 from config import Config
+from rows import Rows
 
-def get_connection():
-    return pymysql.connect(
-        host=Config.MYSQL_HOST,
+class Replica:
+    def __init__(self, address):
+        host, _, port = address.partition(':')
+        self.host = host
+        self.port = int(port) if port else 3306
+        self.healthy = True
+        self.lag = 0
+        self.checked_at = 0
+
+class ReplicaSet:
+    def __init__(self, addresses):
+        self.replicas = [Replica(address) for address in addresses]
+        self.lock = threading.Lock()
+
+    def _check(self, replica):
+        try:
+            conn = _connect(replica.host, replica.port, connect_timeout=Config.REPLICA_CONNECT_TIMEOUT_SECONDS)
+            try:
+                with conn.cursor() as cursor:
+                    try:
+                        cursor.execute("SHOW REPLICA STATUS")
+                    except pymysql.err.ProgrammingError:
+                        cursor.execute("SHOW SLAVE STATUS")
+                    status = cursor.fetchone() or {}
+            finally:
+                conn.close()
+            lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+            # A NULL lag means replication is stopped, so the replica is as good as down
+            replica.healthy = lag is not None and lag <= Config.REPLICA_MAX_LAG_SECONDS
+            replica.lag = lag if lag is not None else float('inf')
+        except pymysql.MySQLError:
+            replica.healthy = False
+        replica.checked_at = time.monotonic()
+
+    def _check_all(self, stale):
+        for replica in stale:
+            self._check(replica)
+
+    def choose(self):
+        now = time.monotonic()
+        with self.lock:
+            stale = [r for r in self.replicas if now - r.checked_at > Config.REPLICA_CHECK_INTERVAL_SECONDS]
+            for replica in stale:
+                replica.checked_at = now
+        # Checks run off the request thread; until they finish, the last known state is used
+        if stale:
+            threading.Thread(target=self._check_all, args=(stale,), name='replica-check', daemon=True).start()
+        healthy = [r for r in self.replicas if r.healthy]
+        if not healthy:
+            return None
+        # Prefer the least lagged replicas, spreading load among equals
+        least_lag = min(r.lag for r in healthy)
+        return random.choice([r for r in healthy if r.lag == least_lag])
+
+    def eject(self, replica):
+        # Stays out until the next health check brings it back
+        replica.healthy = False
+        replica.checked_at = time.monotonic()
+
+replicas = ReplicaSet(Config.MYSQL_REPLICAS)
+
+# Carries the time of a client's last write between requests, for clients with and without cookies
+LAST_WRITE_COOKIE = 'last_write'
+LAST_WRITE_HEADER = 'X-Last-Write'
+
+# MySQL error raised when max_execution_time interrupts a SELECT
+ER_QUERY_TIMEOUT = 3024
+# pymysql's error when the socket read timeout fires mid-statement
+CR_SERVER_LOST = 2013
+
+class StatementTimeout(pymysql.err.OperationalError):
+    pass
+
+def statement_deadline():
+    # Only requests get a deadline; background jobs are allowed to run long statements
+    if not has_request_context():
+        return None
+    return Config.STATEMENT_DEADLINES.get(request.endpoint, Config.STATEMENT_DEADLINE_SECONDS)
+
+def _kill_query(connection):
+    # The client has given up, so stop the statement on the server as well instead of letting it hold locks
+    try:
+        killer = _connect(connection.host, connection.port, deadline=None)
+        try:
+            with killer.cursor() as cursor:
+                cursor.execute("KILL QUERY %s", (connection.thread_id(),))
+        finally:
+            killer.close()
+    except pymysql.MySQLError:
+        pass
+
+# Counts statements per request for the access log and turns deadline errors into StatementTimeout
+class StatementCursorMixin:
+    def execute(self, query, args=None):
+        if has_request_context():
+            g.db_queries = g.get('db_queries', 0) + 1
+        connection = self.connection
+        try:
+            return super().execute(query, args)
+        except pymysql.err.OperationalError as e:
+            code = e.args[0] if e.args else None
+            if code == ER_QUERY_TIMEOUT or (code == CR_SERVER_LOST and connection.deadline):
+                if code == CR_SERVER_LOST:
+                    _kill_query(connection)
+                if has_request_context():
+                    g.statement_timeout = True
+                raise StatementTimeout(code, f"Statement exceeded the {connection.deadline}s deadline") from e
+            raise
+
+class CountingCursor(StatementCursorMixin, pymysql.cursors.DictCursor):
+    pass
+
+class TupleCursor(StatementCursorMixin, pymysql.cursors.Cursor):
+    pass
+
+class DeadlineConnection(pymysql.connections.Connection):
+    def __init__(self, *args, deadline=None, **kwargs):
+        self.deadline = deadline
+        super().__init__(*args, **kwargs)
+
+    def commit(self):
+        super().commit()
+        if has_request_context():
+            g.db_wrote = True
+
+def _connect(host, port, deadline=None, connect_timeout=10):
+    options = {}
+    if deadline:
+        # The server stops SELECTs at max_execution_time; the socket timeout (with a little slack for the
+        # result to arrive) catches everything else
+        options['init_command'] = f"SET SESSION max_execution_time = {int(deadline * 1000)}"
+        options['read_timeout'] = deadline + 1
+    return DeadlineConnection(
+        host=host,
+        port=port,
         user=Config.MYSQL_USER,
         password=Config.MYSQL_PASSWORD,
         db=Config.MYSQL_DB,
         charset='utf8mb4',
-        cursorclass=pymysql.cursors.DictCursor
+        cursorclass=CountingCursor,
+        connect_timeout=connect_timeout,
+        deadline=deadline,
+        **options
     )
 
+def pin_to_primary():
+    # Reads for the rest of this request see the primary, so a request always reads its own writes
+    if has_request_context():
+        g.db_pinned = True
+
+def _last_write():
+    value = request.headers.get(LAST_WRITE_HEADER) or request.cookies.get(LAST_WRITE_COOKIE)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _pinned():
+    if not has_request_context():
+        return False
+    if g.get('db_pinned', False):
+        return True
+    # A write in an earlier request, possibly served by another process, may not have reached the replicas
+    last_write = _last_write()
+    return last_write is not None and 0 <= time.time() - last_write < Config.READ_YOUR_WRITES_SECONDS
+
+def remember_write(response):
+    if g.get('db_wrote'):
+        written_at = f"{time.time():.3f}"
+        response.set_cookie(
+            LAST_WRITE_COOKIE, written_at, max_age=Config.READ_YOUR_WRITES_SECONDS, httponly=True, samesite='Lax'
+        )
+        response.headers[LAST_WRITE_HEADER] = written_at
+    return response
+
+def get_connection(read_only=False):
+    deadline = statement_deadline()
+    # Background jobs read what they or the request that queued them just wrote, so only requests
+    # are routed to replicas
+    if read_only and has_request_context() and not _pinned():
+        replica = replicas.choose()
+        if replica is not None:
+            try:
+                return _connect(replica.host, replica.port, deadline, Config.REPLICA_CONNECT_TIMEOUT_SECONDS)
+            except pymysql.MySQLError:
+                replicas.eject(replica)
+    else:
+        pin_to_primary()
+    return _connect(Config.MYSQL_HOST, Config.MYSQL_PORT, deadline)
+
+def _is_read(query, fetch):
+    statement = query.lstrip().upper()
+    return fetch and statement.startswith(('SELECT', 'SHOW')) and 'FOR UPDATE' not in statement
+
 def execute_query(query, params=None, fetch=True):
-    connection = get_connection()
+    connection = get_connection(read_only=_is_read(query, fetch))
     try:
         with connection.cursor() as cursor:
             cursor.execute(query, params)
@@ -22,11 +211,22 @@ def execute_query(query, params=None, fetch=True):
             connection.commit()
             return cursor.lastrowid
     except Exception as e:
-        connection.rollback()
+        if connection.open:
+            connection.rollback()
         raise e
     finally:
         connection.close()
 
+def execute_rows(query, params=None):
+    # Plain tuples plus one column list, for results too large to hold as a dict per row
+    connection = get_connection(read_only=_is_read(query, True))
+    try:
+        with connection.cursor(TupleCursor) as cursor:
+            cursor.execute(query, params)
+            return Rows([column[0] for column in cursor.description], cursor.fetchall())
+    finally:
+        connection.close()
+
 def execute_many(query, params_list):
     connection = get_connection()
     try:
@@ -34,7 +234,8 @@ def execute_many(query, params_list):
             cursor.executemany(query, params_list)
             connection.commit()
     except Exception as e:
-        connection.rollback()
+        if connection.open:
+            connection.rollback()
         raise e
     finally:
         connection.close()
@@ -43,6 +244,7 @@ def create_db_if_not_exists():
     try:
         conn = pymysql.connect(
             host=Config.MYSQL_HOST,
+            port=Config.MYSQL_PORT,
             user=Config.MYSQL_USER,
             password=Config.MYSQL_PASSWORD
         )
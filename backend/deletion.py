@@ -0,0 +1,104 @@
+import time
+from config import Config
+from db import get_connection
+import jobs
+import org_stats
+
+def _run_chunks(job_id, progress, step, select_query, select_params, delete_ids):
+    # Each chunk is its own short transaction so row locks are held only briefly
+    conn = get_connection()
+    try:
+        while True:
+            with conn.cursor() as cursor:
+                cursor.execute(select_query + " LIMIT %s", list(select_params) + [Config.DELETE_CHUNK_SIZE])
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                delete_ids(cursor, rows)
+                conn.commit()
+            progress[step] = progress.get(step, 0) + len(rows)
+            jobs.update_progress(job_id, progress)
+            time.sleep(Config.DELETE_THROTTLE_SECONDS)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def _placeholders(rows):
+    return ', '.join(['%s'] * len(rows))
+
+def _delete_measurements(cursor, rows):
+    ids = [row['id'] for row in rows]
+    cursor.execute(f"DELETE FROM measurement_values WHERE measurement_id IN ({_placeholders(ids)})", ids)
+    cursor.execute(f"DELETE FROM measurements WHERE id IN ({_placeholders(ids)})", ids)
+    cursor.executemany("""
+        INSERT INTO deleted_records (table_name, record_id, org_id, user_id)
+        VALUES ('measurements', %s, %s, %s)
+    """, [(row['id'], row.get('org_id'), row['user_id']) for row in rows])
+
+def _delete_by_id(table):
+    def delete(cursor, rows):
+        ids = [row['id'] for row in rows]
+        cursor.execute(f"DELETE FROM {table} WHERE id IN ({_placeholders(ids)})", ids)
+    return delete
+
+def _delete_orders(cursor, rows):
+    # Locked and re-read here so the rollup loses exactly what this transaction deletes, even if a
+    # status changed after the chunk was selected
+    ids = [row['id'] for row in rows]
+    deltas = org_stats.removed_order_deltas(cursor, ids)
+    cursor.execute(f"DELETE FROM orders WHERE id IN ({_placeholders(ids)})", ids)
+    org_stats.apply_deltas(deltas, cursor)
+
+def _delete_org_users(cursor, rows):
+    _delete_by_id('org_users')(cursor, rows)
+    cursor.executemany("""
+        INSERT INTO deleted_records (table_name, record_id, org_id)
+        VALUES ('org_users', %s, %s)
+    """, [(row['id'], row['org_id']) for row in rows])
+
+@jobs.register('delete_organization')
+def delete_organization(job_id, payload):
+    org_id = payload['org_id']
+    progress = {}
+    _run_chunks(job_id, progress, 'measurements', """
+        SELECT m.id, m.user_id, ou.org_id FROM measurements m
+        JOIN org_users ou ON m.user_id = ou.id AND m.user_type = 'org_user'
+        WHERE ou.org_id = %s
+    """, [org_id], _delete_measurements)
+    _run_chunks(job_id, progress, 'orders', "SELECT id FROM orders WHERE org_id = %s", [org_id], _delete_orders)
+    _run_chunks(job_id, progress, 'org_users', "SELECT id, org_id FROM org_users WHERE org_id = %s", [org_id], _delete_org_users)
+    _run_chunks(job_id, progress, 'org_admins', "SELECT id FROM org_admins WHERE org_id = %s", [org_id], _delete_by_id('org_admins'))
+
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM size_recommendations WHERE org_id = %s", (org_id,))
+            cursor.execute("DELETE FROM org_stats WHERE org_id = %s", (org_id,))
+            cursor.execute("DELETE FROM organizations WHERE id = %s", (org_id,))
+            conn.commit()
+    finally:
+        conn.close()
+    return progress
+
+@jobs.register('delete_user_data')
+def delete_user_data(job_id, payload):
+    # The user row itself is already gone; this clears what hung off it
+    user_id = payload['user_id']
+    user_type = payload['user_type']
+    progress = {}
+    _run_chunks(job_id, progress, 'measurements', """
+        SELECT id, user_id, %s AS org_id FROM measurements
+        WHERE user_id = %s AND user_type = %s
+    """, [payload.get('org_id'), user_id, user_type], _delete_measurements)
+    if user_type == 'org_user':
+        # Orders an admin placed on the user's behalf carry them as org_user_id
+        _run_chunks(job_id, progress, 'orders', """
+            SELECT id FROM orders WHERE (user_id = %s AND user_type = %s) OR org_user_id = %s
+        """, [user_id, user_type, user_id], _delete_orders)
+    else:
+        _run_chunks(job_id, progress, 'orders', """
+            SELECT id FROM orders WHERE user_id = %s AND user_type = %s
+        """, [user_id, user_type], _delete_orders)
+    return progress
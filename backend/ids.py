@@ -0,0 +1,53 @@
+import os
+import threading
+import time
+
+# Crockford base32 keeps the encoded ids in the same order as the underlying integers
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+DECODE = {char: index for index, char in enumerate(ALPHABET)}
+ENCODED_LENGTH = 26
+
+_lock = threading.Lock()
+_last_ms = 0
+_last_random = 0
+
+def _next_value():
+    # 48-bit millisecond timestamp followed by 80 random bits, monotonic within one process
+    global _last_ms, _last_random
+    with _lock:
+        now = time.time_ns() // 1_000_000
+        if now <= _last_ms:
+            now = _last_ms
+            _last_random = (_last_random + 1) & ((1 << 80) - 1)
+            if _last_random == 0:
+                now += 1
+        else:
+            _last_random = int.from_bytes(os.urandom(10), 'big')
+        _last_ms = now
+        return (now << 80) | _last_random
+
+def _encode(value):
+    chars = []
+    for _ in range(ENCODED_LENGTH):
+        chars.append(ALPHABET[value & 31])
+        value >>= 5
+    return ''.join(reversed(chars))
+
+def new_id(prefix=None):
+    encoded = _encode(_next_value())
+    return f"{prefix}-{encoded}" if prefix else encoded
+
+def id_to_bytes(record_id):
+    # For tables that store ids as BINARY(16); the type prefix is implied by the table
+    encoded = record_id.rsplit('-', 1)[-1]
+    value = 0
+    for char in encoded.upper():
+        value = (value << 5) | DECODE[char]
+    return value.to_bytes(16, 'big')
+
+def id_from_bytes(raw, prefix=None):
+    encoded = _encode(int.from_bytes(raw, 'big'))
+    return f"{prefix}-{encoded}" if prefix else encoded
+
+def id_timestamp(record_id):
+    return int.from_bytes(id_to_bytes(record_id), 'big') >> 80
@@ -1,6 +1,22 @@
 import pymysql
 from config import Config
 
+def _add_column_if_missing(cursor, table, column, definition):
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """, (table, column))
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def _add_index_if_missing(cursor, table, index, columns):
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    """, (table, index))
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f"CREATE INDEX {index} ON {table} ({columns})")
+
 def create_tables():
     try:
         conn = pymysql.connect(
@@ -114,6 +130,7 @@ def create_tables():
                     id VARCHAR(50) PRIMARY KEY,
                     name VARCHAR(255) NOT NULL,
                     description TEXT,
+                    template_version INT NOT NULL DEFAULT 1,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
                 )
@@ -150,6 +167,8 @@ def create_tables():
                     user_id VARCHAR(50) NOT NULL,
                     user_type ENUM('org_user', 'individual') NOT NULL,
                     measurement_type_id VARCHAR(50) NOT NULL,
+                    current_version INT NOT NULL DEFAULT 0,
+                    document JSON,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
                     FOREIGN KEY (measurement_type_id) REFERENCES measurement_types(id) ON DELETE CASCADE
@@ -162,6 +181,7 @@ def create_tables():
                     measurement_id VARCHAR(50) NOT NULL,
                     field_id VARCHAR(50) NOT NULL,
                     value VARCHAR(255) NOT NULL,
+                    value_numeric DECIMAL(10, 3),
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
                     FOREIGN KEY (measurement_id) REFERENCES measurements(id) ON DELETE CASCADE,
@@ -175,6 +195,7 @@ def create_tables():
                     user_id VARCHAR(50) NOT NULL,
                     user_type ENUM('org_user', 'individual') NOT NULL,
                     org_user_id VARCHAR(50),
+                    org_id VARCHAR(50),
                     status VARCHAR(50) DEFAULT 'pending',
                     total_amount DECIMAL(10, 2) NOT NULL,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -182,6 +203,195 @@ def create_tables():
                 )
             """)
             
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS order_items (
+                    id VARCHAR(50) PRIMARY KEY,
+                    order_id VARCHAR(50) NOT NULL,
+                    product_id VARCHAR(50) NOT NULL,
+                    quantity INT NOT NULL DEFAULT 1,
+                    unit_price DECIMAL(10, 2) NOT NULL,
+                    measurement_id VARCHAR(50),
+                    size_label VARCHAR(50),
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE
+                )
+            """)
+            
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS order_status_history (
+                    id VARCHAR(50) PRIMARY KEY,
+                    order_id VARCHAR(50) NOT NULL,
+                    from_status VARCHAR(50),
+                    to_status VARCHAR(50) NOT NULL,
+                    changed_by VARCHAR(50),
+                    note TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    INDEX idx_order_status_history_order (order_id, created_at),
+                    FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE
+                )
+            """)
+            
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS deleted_records (
+                    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    table_name VARCHAR(64) NOT NULL,
+                    record_id VARCHAR(50) NOT NULL,
+                    org_id VARCHAR(50),
+                    user_id VARCHAR(50),
+                    deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    INDEX idx_deleted_records_org (table_name, org_id, deleted_at),
+                    INDEX idx_deleted_records_user (table_name, user_id, deleted_at)
+                )
+            """)
+            
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS org_stats (
+                    org_id VARCHAR(50) NOT NULL,
+                    metric VARCHAR(50) NOT NULL,
+                    bucket VARCHAR(50) NOT NULL DEFAULT '',
+                    value DECIMAL(14, 2) NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    PRIMARY KEY (org_id, metric, bucket)
+                )
+            """)
+            
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS product_sizes (
+                    id VARCHAR(50) PRIMARY KEY,
+                    product_id VARCHAR(50) NOT NULL,
+                    measurement_type_id VARCHAR(50) NOT NULL,
+                    label VARCHAR(50) NOT NULL,
+                    display_order INT DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
+                    FOREIGN KEY (measurement_type_id) REFERENCES measurement_types(id) ON DELETE CASCADE
+                )
+            """)
+            
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS product_size_values (
+                    size_id VARCHAR(50) NOT NULL,
+                    field_id VARCHAR(50) NOT NULL,
+                    value_numeric DECIMAL(10, 3) NOT NULL,
+                    weight DECIMAL(5, 2) NOT NULL DEFAULT 1,
+                    PRIMARY KEY (size_id, field_id),
+                    FOREIGN KEY (size_id) REFERENCES product_sizes(id) ON DELETE CASCADE,
+                    FOREIGN KEY (field_id) REFERENCES measurement_fields(id) ON DELETE CASCADE
+                )
+            """)
+            
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS size_recommendations (
+                    product_id VARCHAR(50) NOT NULL,
+                    user_id VARCHAR(50) NOT NULL,
+                    org_id VARCHAR(50) NOT NULL,
+                    size_id VARCHAR(50) NOT NULL,
+                    size_label VARCHAR(50) NOT NULL,
+                    measurement_id VARCHAR(50) NOT NULL,
+                    distance DECIMAL(10, 3) NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    PRIMARY KEY (product_id, user_id),
+                    INDEX idx_size_recommendations_org (org_id, product_id),
+                    FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
+                )
+            """)
+            
+            # measurement_values stays the materialized latest version; these tables hold each save's changes
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS measurement_versions (
+                    measurement_id VARCHAR(50) NOT NULL,
+                    version INT NOT NULL,
+                    changed_fields INT NOT NULL DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (measurement_id, version),
+                    FOREIGN KEY (measurement_id) REFERENCES measurements(id) ON DELETE CASCADE
+                )
+            """)
+            
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS measurement_value_deltas (
+                    measurement_id VARCHAR(50) NOT NULL,
+                    version INT NOT NULL,
+                    field_id VARCHAR(50) NOT NULL,
+                    value VARCHAR(255) NOT NULL,
+                    value_numeric DECIMAL(10, 3),
+                    PRIMARY KEY (measurement_id, version, field_id),
+                    FOREIGN KEY (measurement_id, version) REFERENCES measurement_versions(measurement_id, version) ON DELETE CASCADE
+                )
+            """)
+            
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id VARCHAR(50) PRIMARY KEY,
+                    job_type VARCHAR(50) NOT NULL,
+                    payload JSON,
+                    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+                    progress JSON,
+                    result JSON,
+                    error TEXT,
+                    attempts INT NOT NULL DEFAULT 0,
+                    max_attempts INT NOT NULL DEFAULT 3,
+                    cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+                    run_after TIMESTAMP NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    started_at TIMESTAMP NULL,
+                    heartbeat_at TIMESTAMP NULL,
+                    finished_at TIMESTAMP NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    INDEX idx_jobs_status_created (status, created_at)
+                )
+            """)
+            
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS archived_records (
+                    table_name VARCHAR(64) NOT NULL,
+                    record_id VARCHAR(50) NOT NULL,
+                    partition_path VARCHAR(255) NOT NULL,
+                    member_offset BIGINT NOT NULL,
+                    member_length INT NOT NULL,
+                    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (table_name, record_id)
+                )
+            """)
+            
+            # Orders placed for organization users carry their org so org boards are one index range
+            _add_column_if_missing(cursor, 'orders', 'org_id', 'VARCHAR(50) AFTER org_user_id')
+            cursor.execute("""
+                UPDATE orders o
+                JOIN org_users ou ON ou.id = COALESCE(o.org_user_id, o.user_id)
+                SET o.org_id = ou.org_id
+                WHERE o.org_id IS NULL AND o.user_type = 'org_user'
+            """)
+            _add_index_if_missing(cursor, 'orders', 'idx_orders_user_created', 'user_id, created_at')
+            _add_index_if_missing(cursor, 'orders', 'idx_orders_status_created', 'status, created_at')
+            _add_index_if_missing(cursor, 'orders', 'idx_orders_org_created', 'org_id, created_at')
+            _add_index_if_missing(cursor, 'org_users', 'idx_org_users_org_updated', 'org_id, updated_at')
+            _add_index_if_missing(cursor, 'org_users', 'idx_org_users_org_created', 'org_id, created_at')
+            _add_index_if_missing(cursor, 'orders', 'idx_orders_org_user_created', 'org_user_id, created_at')
+            _add_index_if_missing(
+                cursor, 'measurements', 'idx_measurements_user_type_updated', 'user_id, measurement_type_id, updated_at'
+            )
+            _add_index_if_missing(cursor, 'products', 'idx_products_updated', 'updated_at')
+            _add_index_if_missing(
+                cursor, 'measurements', 'idx_measurements_user_type_created', 'user_id, measurement_type_id, created_at'
+            )
+            _add_index_if_missing(cursor, 'measurements', 'idx_measurements_user_updated', 'user_id, updated_at')
+            _add_column_if_missing(cursor, 'measurement_values', 'value_numeric', 'DECIMAL(10, 3) AFTER value')
+            _add_column_if_missing(cursor, 'order_items', 'size_label', 'VARCHAR(50) AFTER measurement_id')
+            _add_column_if_missing(cursor, 'measurements', 'current_version', 'INT NOT NULL DEFAULT 0 AFTER measurement_type_id')
+            _add_column_if_missing(cursor, 'measurements', 'document', 'JSON AFTER current_version')
+            _add_column_if_missing(cursor, 'measurement_types', 'template_version', 'INT NOT NULL DEFAULT 1 AFTER description')
+            _add_column_if_missing(cursor, 'jobs', 'attempts', 'INT NOT NULL DEFAULT 0 AFTER error')
+            _add_column_if_missing(cursor, 'jobs', 'max_attempts', 'INT NOT NULL DEFAULT 3 AFTER attempts')
+            _add_column_if_missing(cursor, 'jobs', 'cancel_requested', 'BOOLEAN NOT NULL DEFAULT FALSE AFTER max_attempts')
+            _add_column_if_missing(cursor, 'jobs', 'run_after', 'TIMESTAMP NULL AFTER cancel_requested')
+            _add_column_if_missing(cursor, 'jobs', 'heartbeat_at', 'TIMESTAMP NULL AFTER started_at')
+            _add_index_if_missing(cursor, 'measurement_sections', 'idx_measurement_sections_type_order', 'measurement_type_id, display_order')
+            _add_index_if_missing(cursor, 'measurement_fields', 'idx_measurement_fields_section_order', 'section_id, display_order')
+            _add_index_if_missing(cursor, 'measurement_values', 'idx_measurement_values_field_numeric', 'field_id, value_numeric')
+            
         conn.commit()
         conn.close()
         print("Database tables created successfully!")
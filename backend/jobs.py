@@ -0,0 +1,271 @@
+import importlib
+import json
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from config import Config
+from db import get_connection, execute_query, execute_many
+from ids import new_id
+from structured_logging import get_log_queue, init_worker_logging
+
+# Modules whose handlers must be registered in every worker process
+HANDLER_MODULES = ['deletion', 'size_recommendation', 'org_stats', 'archive', 'measurement_documents']
+
+_handlers = {}
+_wakeup = threading.Event()
+_runner = None
+
+class JobCancelled(Exception):
+    pass
+
+def register(job_type):
+    def decorator(func):
+        _handlers[job_type] = func
+        return func
+    return decorator
+
+def submit(job_type, payload, max_attempts=Config.JOB_MAX_ATTEMPTS):
+    job_id = new_id('job')
+    query = """
+        INSERT INTO jobs (id, job_type, payload, status, max_attempts)
+        VALUES (%s, %s, %s, 'queued', %s)
+    """
+    execute_query(query, (job_id, job_type, json.dumps(payload), max_attempts), fetch=False)
+    _wakeup.set()
+    return job_id
+
+def update_progress(job_id, progress):
+    # Doubles as the cancellation checkpoint for long-running handlers
+    query = "UPDATE jobs SET progress = %s, heartbeat_at = CURRENT_TIMESTAMP WHERE id = %s"
+    execute_query(query, (json.dumps(progress), job_id), fetch=False)
+    check_cancelled(job_id)
+
+def check_cancelled(job_id):
+    result = execute_query("SELECT cancel_requested FROM jobs WHERE id = %s", (job_id,))
+    if result and result[0]['cancel_requested']:
+        raise JobCancelled()
+
+def cancel(job_id):
+    execute_query(
+        "UPDATE jobs SET status = 'cancelled', finished_at = CURRENT_TIMESTAMP WHERE id = %s AND status = 'queued'",
+        (job_id,), fetch=False
+    )
+    execute_query(
+        "UPDATE jobs SET cancel_requested = TRUE WHERE id = %s AND status = 'running'", (job_id,), fetch=False
+    )
+    return get_job(job_id)
+
+def _update_claim(job_id, attempt, assignments, params):
+    # attempts doubles as the claim token: only the worker holding the current claim may record an outcome,
+    # so a job reclaimed after its lease lapsed is not finished twice
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = %s AND status = 'running' AND attempts = %s",
+                list(params) + [job_id, attempt]
+            )
+            updated = cursor.rowcount
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    if not updated:
+        logging.warning(f"Job {job_id} attempt {attempt} no longer holds its claim; outcome dropped")
+    return updated
+
+def _finish(job_id, attempt, status, result=None, error=None):
+    # A cancel requested while the handler ran wins over whatever it returned
+    _update_claim(job_id, attempt, """
+        status = IF(cancel_requested, 'cancelled', %s), result = %s, error = %s, finished_at = CURRENT_TIMESTAMP
+    """, [status, json.dumps(result) if result is not None else None, error])
+
+def _retry_or_fail(job_id, attempts, max_attempts, error):
+    if attempts < max_attempts:
+        # Exponential backoff: 2, 4, 8... seconds
+        _update_claim(job_id, attempts, """
+            status = IF(cancel_requested, 'cancelled', 'queued'), error = %s,
+            run_after = CURRENT_TIMESTAMP + INTERVAL %s SECOND,
+            finished_at = IF(cancel_requested, CURRENT_TIMESTAMP, NULL)
+        """, [error, 2 ** attempts])
+    else:
+        _finish(job_id, attempts, 'failed', error=error)
+
+def _requeue(claims):
+    # These claims never reached a worker, so they don't count as attempts
+    execute_many("""
+        UPDATE jobs SET status = 'queued', attempts = attempts - 1, heartbeat_at = NULL
+        WHERE id = %s AND attempts = %s AND status = 'running'
+    """, claims)
+
+def _worker_failed(job_id, attempt, error):
+    # run_job never recorded an outcome, e.g. its worker process died
+    job = execute_query("SELECT max_attempts FROM jobs WHERE id = %s", (job_id,))
+    if job:
+        _retry_or_fail(job_id, attempt, job[0]['max_attempts'], error)
+
+def _heartbeat(job_id, attempt, stopped):
+    # Renews the lease while the handler runs, including handlers that never report progress
+    while not stopped.wait(Config.JOB_LEASE_SECONDS / 3):
+        try:
+            execute_query("""
+                UPDATE jobs SET heartbeat_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND attempts = %s AND status = 'running'
+            """, (job_id, attempt), fetch=False)
+        except Exception as e:
+            logging.error(f"Job {job_id} heartbeat failed: {str(e)}")
+
+def _init_worker(log_queue):
+    init_worker_logging(log_queue)
+    for module in HANDLER_MODULES:
+        importlib.import_module(module)
+
+def run_job(job_id, attempt):
+    # Runs inside a worker process; the dispatcher has already marked the job running as this attempt
+    job = execute_query(
+        "SELECT job_type, payload, max_attempts FROM jobs WHERE id = %s AND attempts = %s AND status = 'running'",
+        (job_id, attempt)
+    )
+    if not job:
+        return
+    job = job[0]
+    stopped = threading.Event()
+    threading.Thread(
+        target=_heartbeat, args=(job_id, attempt, stopped), name='job-heartbeat', daemon=True
+    ).start()
+    try:
+        result = _handlers[job['job_type']](job_id, json.loads(job['payload']))
+        _finish(job_id, attempt, 'completed', result=result)
+    except JobCancelled:
+        _finish(job_id, attempt, 'cancelled')
+    except Exception as e:
+        logging.error(f"Job {job_id} failed: {str(e)}")
+        _retry_or_fail(job_id, attempt, job['max_attempts'], str(e))
+    finally:
+        stopped.set()
+
+def _claim_jobs(limit):
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            # Running jobs whose lease lapsed lost their worker (a crash or restart) and are taken over
+            cursor.execute("""
+                SELECT id, status, attempts, max_attempts FROM jobs
+                WHERE (status = 'queued' AND (run_after IS NULL OR run_after <= CURRENT_TIMESTAMP))
+                   OR (status = 'running'
+                       AND COALESCE(heartbeat_at, started_at) < CURRENT_TIMESTAMP - INTERVAL %s SECOND)
+                ORDER BY created_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (Config.JOB_LEASE_SECONDS, limit))
+            rows = cursor.fetchall()
+            # A lapsed lease was an attempt too; one that used the last attempt fails instead of running again
+            exhausted = [
+                row['id'] for row in rows if row['status'] == 'running' and row['attempts'] >= row['max_attempts']
+            ]
+            claims = [(row['id'], row['attempts'] + 1) for row in rows if row['id'] not in exhausted]
+            ids = [job_id for job_id, _ in claims]
+            if exhausted:
+                placeholders = ', '.join(['%s'] * len(exhausted))
+                cursor.execute(f"""
+                    UPDATE jobs SET status = 'failed', error = 'Worker lost', finished_at = CURRENT_TIMESTAMP
+                    WHERE id IN ({placeholders})
+                """, exhausted)
+            if ids:
+                placeholders = ', '.join(['%s'] * len(ids))
+                cursor.execute(f"""
+                    UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = CURRENT_TIMESTAMP,
+                        heartbeat_at = CURRENT_TIMESTAMP
+                    WHERE id IN ({placeholders})
+                """, ids)
+            conn.commit()
+            return claims
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+class JobRunner:
+    def __init__(self, workers=Config.JOB_WORKERS):
+        self.workers = workers
+        self.pool = self._new_pool()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._dispatch, name='job-dispatcher', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker, initargs=(get_log_queue(),)
+        )
+
+    def _done(self, future):
+        with self.lock:
+            job_id, attempt = self.in_flight.pop(future, (None, None))
+        error = future.exception()
+        if error is not None and job_id:
+            logging.error(f"Job {job_id} worker failed: {str(error)}")
+            try:
+                _worker_failed(job_id, attempt, str(error) or type(error).__name__)
+            except Exception as e:
+                logging.error(f"Job {job_id} could not be requeued: {str(e)}")
+        _wakeup.set()
+
+    def _dispatch(self):
+        while True:
+            _wakeup.wait(Config.JOB_POLL_SECONDS)
+            _wakeup.clear()
+            try:
+                with self.lock:
+                    free = self.workers - len(self.in_flight)
+                if free <= 0:
+                    continue
+                claims = _claim_jobs(free)
+                for position, (job_id, attempt) in enumerate(claims):
+                    try:
+                        future = self.pool.submit(run_job, job_id, attempt)
+                    except Exception as e:
+                        _requeue(claims[position:])
+                        # A worker died and took the pool with it; later jobs get a fresh one
+                        if isinstance(e, BrokenProcessPool):
+                            self.pool = self._new_pool()
+                        raise
+                    with self.lock:
+                        self.in_flight[future] = (job_id, attempt)
+                    future.add_done_callback(self._done)
+            except Exception as e:
+                logging.error(f"Job dispatcher error: {str(e)}")
+
+def start_job_runner():
+    global _runner
+    if _runner is None and Config.JOB_WORKERS > 0:
+        _runner = JobRunner()
+        _runner.start()
+    return _runner
+
+def get_job(job_id):
+    query = """
+        SELECT id, job_type, status, progress, error, attempts, max_attempts, cancel_requested,
+               created_at, started_at, finished_at
+        FROM jobs WHERE id = %s
+    """
+    result = execute_query(query, (job_id,))
+    if not result:
+        return None
+    job = result[0]
+    if job['progress'] is not None:
+        job['progress'] = json.loads(job['progress'])
+    return job
+
+def get_job_result(job_id):
+    result = execute_query("SELECT status, result FROM jobs WHERE id = %s", (job_id,))
+    if not result:
+        return None
+    job = result[0]
+    return {'status': job['status'], 'result': json.loads(job['result']) if job['result'] is not None else None}
@@ -0,0 +1,101 @@
+import json
+import sys
+from db import get_connection
+import jobs
+
+DOCUMENT_QUERY = """
+    SELECT mv.id, mv.field_id, mv.value, mf.name as field_name, mf.unit,
+           ms.title as section_title, ms.id as section_id
+    FROM measurement_values mv
+    JOIN measurement_fields mf ON mv.field_id = mf.id
+    JOIN measurement_sections ms ON mf.section_id = ms.id
+    WHERE mv.measurement_id = %s
+    ORDER BY ms.display_order, mf.display_order
+"""
+
+def group_values_by_section(values):
+    sections = {}
+    for value in values:
+        section = sections.setdefault(value['section_id'], {
+            'id': value['section_id'],
+            'title': value['section_title'],
+            'values': []
+        })
+        section['values'].append({
+            'id': value.get('id'),
+            'field_id': value['field_id'],
+            'field_name': value['field_name'],
+            'unit': value['unit'],
+            'value': value['value']
+        })
+    return list(sections.values())
+
+def build_document(type_name, values):
+    return {'type_name': type_name, 'sections': group_values_by_section(values)}
+
+def refresh_document(cursor, measurement_id):
+    # Runs on the writer's cursor so the document commits together with the values it describes
+    cursor.execute("""
+        SELECT mt.name FROM measurements m
+        JOIN measurement_types mt ON m.measurement_type_id = mt.id
+        WHERE m.id = %s
+    """, (measurement_id,))
+    measurement_type = cursor.fetchone()
+    if not measurement_type:
+        return None
+    cursor.execute(DOCUMENT_QUERY, (measurement_id,))
+    document = build_document(measurement_type['name'], cursor.fetchall())
+    # The document is a cache of the values: keeping updated_at means a refresh is not a change to delta sync
+    # or to which measurement counts as the newest; writers stamp updated_at themselves
+    cursor.execute(
+        "UPDATE measurements SET document = %s, updated_at = updated_at WHERE id = %s",
+        (json.dumps(document), measurement_id)
+    )
+    return document
+
+def load_document(raw):
+    if raw is None:
+        return None
+    return json.loads(raw) if isinstance(raw, (str, bytes)) else raw
+
+def flatten_document(measurement_id, document):
+    return [
+        dict(value, measurement_id=measurement_id, section_title=section['title'])
+        for section in document['sections'] for value in section['values']
+    ]
+
+def backfill_documents(batch_size=500, type_id=None, job_id=None):
+    conditions = ["document IS NULL"]
+    params = []
+    if type_id:
+        conditions.append("measurement_type_id = %s")
+        params.append(type_id)
+    refreshed = 0
+    conn = get_connection()
+    try:
+        while True:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT id FROM measurements WHERE {' AND '.join(conditions)} ORDER BY id LIMIT %s",
+                    params + [batch_size]
+                )
+                ids = [row['id'] for row in cursor.fetchall()]
+                if not ids:
+                    break
+                for measurement_id in ids:
+                    refresh_document(cursor, measurement_id)
+                conn.commit()
+            refreshed += len(ids)
+            if job_id:
+                jobs.update_progress(job_id, {'refreshed': refreshed})
+    finally:
+        conn.close()
+    return refreshed
+
+@jobs.register('refresh_documents')
+def refresh_documents_job(job_id, payload):
+    # Template edits clear the type's documents, so readers use the joins until these are rebuilt
+    return {'refreshed': backfill_documents(type_id=payload['type_id'], job_id=job_id)}
+
+if __name__ == '__main__':
+    backfill_documents(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
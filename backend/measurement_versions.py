@@ -0,0 +1,57 @@
+from db import get_connection, execute_query
+
+VERSION_QUERY = """
+    INSERT INTO measurement_versions (measurement_id, version, changed_fields)
+    VALUES (%s, %s, %s)
+"""
+
+DELTA_QUERY = """
+    INSERT INTO measurement_value_deltas (measurement_id, version, field_id, value, value_numeric)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+# changes are (field_id, value, value_numeric) for the fields that differ from the previous version;
+# pass a cursor to write them inside the caller's transaction
+def write_version(measurement_id, version, changes, cursor=None):
+    if cursor is None:
+        conn = get_connection()
+        try:
+            with conn.cursor() as own_cursor:
+                write_version(measurement_id, version, changes, own_cursor)
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return
+    cursor.execute(VERSION_QUERY, (measurement_id, version, len(changes)))
+    if changes:
+        cursor.executemany(DELTA_QUERY, [
+            (measurement_id, version, field_id, value, numeric) for field_id, value, numeric in changes
+        ])
+
+def list_versions(measurement_id):
+    query = """
+        SELECT version, changed_fields, created_at
+        FROM measurement_versions
+        WHERE measurement_id = %s
+        ORDER BY version
+    """
+    return execute_query(query, (measurement_id,))
+
+def reconstruct_version(measurement_id, version):
+    # Replaying deltas up to the requested version is one primary-key range read
+    query = """
+        SELECT d.field_id, d.value, d.value_numeric, mf.name as field_name, mf.unit,
+               ms.title as section_title, ms.id as section_id
+        FROM measurement_value_deltas d
+        JOIN measurement_fields mf ON d.field_id = mf.id
+        JOIN measurement_sections ms ON mf.section_id = ms.id
+        WHERE d.measurement_id = %s AND d.version <= %s
+        ORDER BY d.version
+    """
+    values = {}
+    for row in execute_query(query, (measurement_id, version)):
+        values[row['field_id']] = row
+    return list(values.values())
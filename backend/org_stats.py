@@ -0,0 +1,146 @@
+import sys
+from collections import defaultdict
+from db import get_connection
+import jobs
+
+USERS = 'users'
+MEASUREMENTS = 'measurements_by_type'
+ORDERS = 'orders_by_status'
+ORDER_VALUE = 'order_value_by_month'
+
+UPSERT_QUERY = """
+    INSERT INTO org_stats (org_id, metric, bucket, value)
+    VALUES (%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE value = value + VALUES(value)
+"""
+
+def _merge(deltas):
+    merged = defaultdict(int)
+    for org_id, metric, bucket, delta in deltas:
+        if org_id:
+            merged[(org_id, metric, bucket or '')] += delta
+    # Sorted so concurrent writers take row locks in the same order
+    return [key + (delta,) for key, delta in sorted(merged.items()) if delta]
+
+# deltas are (org_id, metric, bucket, delta); pass a cursor to apply them inside the caller's transaction
+def apply_deltas(deltas, cursor=None):
+    rows = _merge(deltas)
+    if not rows:
+        return
+    if cursor is not None:
+        cursor.executemany(UPSERT_QUERY, rows)
+        return
+    conn = get_connection()
+    try:
+        with conn.cursor() as own_cursor:
+            own_cursor.executemany(UPSERT_QUERY, rows)
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def _placeholders(ids):
+    return ', '.join(['%s'] * len(ids))
+
+# Lock the rows about to be removed and return what they take out of the rollup, bucketed as the rebuild does
+def removed_order_deltas(cursor, order_ids):
+    cursor.execute(f"""
+        SELECT org_id, status, total_amount, DATE_FORMAT(created_at, '%%Y-%%m') AS month
+        FROM orders WHERE id IN ({_placeholders(order_ids)})
+        FOR UPDATE
+    """, order_ids)
+    deltas = []
+    for order in cursor.fetchall():
+        deltas.append((order['org_id'], ORDERS, order['status'], -1))
+        deltas.append((order['org_id'], ORDER_VALUE, order['month'], -order['total_amount']))
+    return deltas
+
+def removed_measurement_deltas(cursor, measurement_ids):
+    cursor.execute(f"""
+        SELECT ou.org_id, m.measurement_type_id
+        FROM measurements m
+        JOIN org_users ou ON m.user_id = ou.id AND m.user_type = 'org_user'
+        WHERE m.id IN ({_placeholders(measurement_ids)})
+        FOR UPDATE
+    """, measurement_ids)
+    return [(row['org_id'], MEASUREMENTS, row['measurement_type_id'], -1) for row in cursor.fetchall()]
+
+def get_org_stats(org_id):
+    conn = get_connection(read_only=True)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT metric, bucket, value FROM org_stats WHERE org_id = %s", (org_id,))
+            rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    stats = {USERS: 0, MEASUREMENTS: {}, ORDERS: {}, ORDER_VALUE: {}}
+    for row in rows:
+        if row['metric'] == USERS:
+            stats[USERS] = int(row['value'])
+        elif row['metric'] == ORDER_VALUE:
+            stats[ORDER_VALUE][row['bucket']] = str(row['value'])
+        elif row['metric'] in stats:
+            stats[row['metric']][row['bucket']] = int(row['value'])
+    return stats
+
+REBUILD_QUERIES = [
+    (USERS, """
+        SELECT org_id, '' AS bucket, COUNT(*) AS value
+        FROM org_users {where}
+        GROUP BY org_id
+    """),
+    (MEASUREMENTS, """
+        SELECT ou.org_id, m.measurement_type_id AS bucket, COUNT(*) AS value
+        FROM measurements m
+        JOIN org_users ou ON m.user_id = ou.id AND m.user_type = 'org_user'
+        {where}
+        GROUP BY ou.org_id, m.measurement_type_id
+    """),
+    (ORDERS, """
+        SELECT org_id, status AS bucket, COUNT(*) AS value
+        FROM orders {where}
+        GROUP BY org_id, status
+    """),
+    (ORDER_VALUE, """
+        SELECT org_id, DATE_FORMAT(created_at, '%%Y-%%m') AS bucket, SUM(total_amount) AS value
+        FROM orders {where}
+        GROUP BY org_id, DATE_FORMAT(created_at, '%%Y-%%m')
+    """),
+]
+
+def rebuild_org_stats(org_id=None):
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            if org_id:
+                cursor.execute("DELETE FROM org_stats WHERE org_id = %s", (org_id,))
+            else:
+                cursor.execute("DELETE FROM org_stats")
+
+            for metric, query in REBUILD_QUERIES:
+                org_column = 'ou.org_id' if metric == MEASUREMENTS else 'org_id'
+                where = f"WHERE {org_column} = %s" if org_id else f"WHERE {org_column} IS NOT NULL"
+                cursor.execute(query.format(where=where), (org_id,) if org_id else ())
+                rows = [
+                    (row['org_id'], metric, row['bucket'] or '', row['value'])
+                    for row in cursor.fetchall()
+                ]
+                if rows:
+                    cursor.executemany(UPSERT_QUERY, rows)
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+@jobs.register('rebuild_org_stats')
+def rebuild_org_stats_job(job_id, payload):
+    rebuild_org_stats(payload.get('org_id'))
+    return {'org_id': payload.get('org_id')}
+
+if __name__ == '__main__':
+    rebuild_org_stats(sys.argv[1] if len(sys.argv) > 1 else None)
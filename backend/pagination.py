@@ -0,0 +1,24 @@
+import base64
+from datetime import datetime
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def get_page_size(value):
+    try:
+        size = int(value) if value is not None else DEFAULT_PAGE_SIZE
+    except (TypeError, ValueError):
+        raise ValueError('Invalid limit')
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+def encode_cursor(created_at, row_id):
+    raw = f"{created_at.strftime('%Y-%m-%d %H:%M:%S')}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, row_id = raw.split('|', 1)
+        return datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S'), row_id
+    except Exception:
+        raise ValueError('Invalid cursor')
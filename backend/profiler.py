@@ -0,0 +1,106 @@
+import hmac
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from flask import g, request
+from config import Config
+
+MAX_DEPTH = 128
+TRUNCATED = '[truncated]'
+
+def _fold(frame):
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+# Samples the stacks of the request threads being profiled and aggregates them per endpoint as
+# folded stacks ("frame;frame;frame count"), the input format of flamegraph.pl and speedscope
+class StackSampler:
+    def __init__(self, interval=Config.PROFILE_INTERVAL_SECONDS, max_stacks=Config.PROFILE_MAX_STACKS):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.lock = threading.Lock()
+        self.active = {}
+        self.stacks = {}
+        self.requests = Counter()
+        self.thread = None
+
+    def start(self, endpoint):
+        with self.lock:
+            self.active[threading.get_ident()] = endpoint
+            self.requests[endpoint] += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            self.active.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if not self.active:
+                    # Nothing to watch; the next profiled request starts a new thread
+                    self.thread = None
+                    return
+                targets = dict(self.active)
+            frames = sys._current_frames()
+            samples = [(endpoint, _fold(frames[ident])) for ident, endpoint in targets.items() if ident in frames]
+            with self.lock:
+                for endpoint, stack in samples:
+                    counts = self.stacks.setdefault(endpoint, Counter())
+                    if stack not in counts and len(counts) >= self.max_stacks:
+                        stack = TRUNCATED
+                    counts[stack] += 1
+            del frames
+            time.sleep(self.interval)
+
+    def summary(self):
+        with self.lock:
+            return [
+                {'endpoint': endpoint, 'requests': self.requests[endpoint],
+                 'samples': sum(self.stacks.get(endpoint, {}).values())}
+                for endpoint in sorted(self.requests)
+            ]
+
+    def folded(self, endpoint):
+        with self.lock:
+            counts = dict(self.stacks.get(endpoint, {}))
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+
+    def reset(self, endpoint=None):
+        with self.lock:
+            if endpoint is None:
+                self.stacks.clear()
+                self.requests.clear()
+            else:
+                self.stacks.pop(endpoint, None)
+                self.requests.pop(endpoint, None)
+
+sampler = StackSampler()
+
+def is_authorized(req):
+    # Compared as bytes: compare_digest rejects str arguments with non-ASCII characters
+    return bool(Config.PROFILE_TOKEN) and hmac.compare_digest(
+        req.headers.get('X-Profile', '').encode('utf-8'), Config.PROFILE_TOKEN.encode('utf-8')
+    )
+
+def init_profiling(app):
+    @app.before_request
+    def maybe_profile():
+        # With profiling off this is one header lookup per request
+        if request.endpoint is None or request.endpoint.startswith('profiling.'):
+            return
+        if is_authorized(request) or (Config.PROFILE_SAMPLE_RATE and random.random() < Config.PROFILE_SAMPLE_RATE):
+            sampler.start(request.endpoint)
+            g.profiling = True
+
+    @app.teardown_request
+    def stop_profile(exc):
+        if g.pop('profiling', False):
+            sampler.stop()
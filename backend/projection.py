@@ -0,0 +1,19 @@
+def parse_fields(value, allowed):
+    if not value:
+        return list(allowed)
+    fields = list(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+def select_columns(allowed, value, required=('id',)):
+    # allowed maps each field a client may ask for to the SQL expression that produces it;
+    # required fields (keys, cursor columns) are always selected
+    fields = parse_fields(value, allowed)
+    fields = [field for field in required if field not in fields] + fields
+    columns = []
+    for field in fields:
+        expression = allowed[field]
+        columns.append(expression if expression.split('.')[-1] == field else f"{expression} AS {field}")
+    return ', '.join(columns)
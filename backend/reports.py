@@ -0,0 +1,158 @@
+import csv
+import html
+import io
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from config import Config
+from db import execute_query
+from measurement_documents import group_values_by_section, load_document
+from structured_logging import get_log_queue, init_worker_logging
+
+_pool = None
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=Config.REPORT_WORKERS, initializer=init_worker_logging, initargs=(get_log_queue(),)
+        )
+    return _pool
+
+def _chunks(items, size=1000):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def fetch_sheet_data(org_id, type_id=None):
+    org = execute_query("SELECT id, name FROM organizations WHERE id = %s", (org_id,))
+    if not org:
+        return None
+
+    users = execute_query("""
+        SELECT id, name, email, phone, department FROM org_users
+        WHERE org_id = %s ORDER BY department, name
+    """, (org_id,))
+
+    query = """
+        SELECT m.id, m.user_id, m.measurement_type_id, m.document, m.updated_at
+        FROM measurements m
+        JOIN org_users ou ON m.user_id = ou.id AND m.user_type = 'org_user'
+        WHERE ou.org_id = %s
+    """
+    params = [org_id]
+    if type_id:
+        query += " AND m.measurement_type_id = %s"
+        params.append(type_id)
+    measurements = execute_query(query + " ORDER BY m.updated_at", params)
+
+    # Measurements saved before documents existed are regrouped from their values in a few batched reads
+    missing = [m['id'] for m in measurements if m['document'] is None]
+    fallback = {}
+    if missing:
+        types = {row['id']: row['name'] for row in execute_query("SELECT id, name FROM measurement_types")}
+        values_by_measurement = {}
+        for chunk in _chunks(missing):
+            placeholders = ', '.join(['%s'] * len(chunk))
+            rows = execute_query(f"""
+                SELECT mv.id, mv.measurement_id, mv.field_id, mv.value, mf.name as field_name, mf.unit,
+                       ms.title as section_title, ms.id as section_id
+                FROM measurement_values mv
+                JOIN measurement_fields mf ON mv.field_id = mf.id
+                JOIN measurement_sections ms ON mf.section_id = ms.id
+                WHERE mv.measurement_id IN ({placeholders})
+                ORDER BY ms.display_order, mf.display_order
+            """, chunk)
+            for row in rows:
+                values_by_measurement.setdefault(row['measurement_id'], []).append(row)
+        for m in measurements:
+            if m['document'] is None:
+                fallback[m['id']] = {
+                    'type_name': types.get(m['measurement_type_id'], ''),
+                    'sections': group_values_by_section(values_by_measurement.get(m['id'], []))
+                }
+
+    # Later measurements of the same type replace earlier ones on the sheet
+    latest = {}
+    for m in measurements:
+        document = load_document(m['document']) or fallback[m['id']]
+        latest[(m['user_id'], m['measurement_type_id'])] = document
+
+    sheets_by_user = {}
+    for (user_id, _), document in latest.items():
+        sheets_by_user.setdefault(user_id, []).append(document)
+
+    departments = {}
+    for user in users:
+        sheets = sheets_by_user.get(user['id'], [])
+        departments.setdefault(user['department'] or 'Unassigned', []).append({
+            'name': user['name'],
+            'email': user['email'],
+            'phone': user['phone'],
+            'measurements': sheets
+        })
+    return {'org_name': org[0]['name'], 'departments': departments}
+
+def render_department(org_name, department, users):
+    # Runs in a worker process, so it only touches its arguments
+    csv_buffer = io.StringIO()
+    writer = csv.writer(csv_buffer)
+    writer.writerow(['Employee', 'Email', 'Phone', 'Measurement', 'Section', 'Field', 'Value', 'Unit'])
+
+    parts = [
+        '<html><head><meta charset="utf-8"><style>',
+        'body{font-family:sans-serif} .sheet{page-break-after:always} ',
+        'table{border-collapse:collapse} td,th{border:1px solid #999;padding:4px 8px}',
+        '</style></head><body>'
+    ]
+    for user in users:
+        parts.append(f'<div class="sheet"><h2>{html.escape(user["name"])}</h2>')
+        parts.append(f'<p>{html.escape(org_name)} &middot; {html.escape(department)} &middot; '
+                     f'{html.escape(user["email"] or "")} &middot; {html.escape(user["phone"] or "")}</p>')
+        for document in user['measurements']:
+            parts.append(f'<h3>{html.escape(document["type_name"])}</h3>')
+            for section in document['sections']:
+                parts.append(f'<h4>{html.escape(section["title"])}</h4><table>')
+                for value in section['values']:
+                    unit = value['unit'] or ''
+                    writer.writerow([
+                        user['name'], user['email'], user['phone'], document['type_name'],
+                        section['title'], value['field_name'], value['value'], unit
+                    ])
+                    parts.append(
+                        f'<tr><th>{html.escape(value["field_name"])}</th>'
+                        f'<td>{html.escape(str(value["value"]))} {html.escape(unit)}</td></tr>'
+                    )
+                parts.append('</table>')
+        parts.append('</div>')
+    parts.append('</body></html>')
+    return department, csv_buffer.getvalue(), ''.join(parts)
+
+def _safe_name(name, used):
+    # Different departments can sanitise to the same name, e.g. "R&D" and "R/D"; later ones get -2, -3...
+    # Compared case-insensitively since archives are often unpacked onto case-insensitive filesystems
+    base = ''.join(char if char.isalnum() or char in '-_' else '_' for char in name) or 'department'
+    candidate = base
+    suffix = 2
+    while candidate.lower() in used:
+        candidate = f"{base}-{suffix}"
+        suffix += 1
+    used.add(candidate.lower())
+    return candidate
+
+def build_sheet_archive(data):
+    # Spooled to disk past 10 MB so large orgs do not sit in memory while the response streams
+    archive = tempfile.SpooledTemporaryFile(max_size=10 * 1024 * 1024)
+    pool = _get_pool()
+    futures = [
+        pool.submit(render_department, data['org_name'], department, users)
+        for department, users in data['departments'].items()
+    ]
+    used_names = set()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for future in futures:
+            department, csv_text, html_text = future.result()
+            name = _safe_name(department, used_names)
+            zf.writestr(f"{name}.csv", csv_text)
+            zf.writestr(f"{name}.html", html_text)
+    archive.seek(0)
+    return archive
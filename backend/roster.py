@@ -0,0 +1,135 @@
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+from db import execute_query, pin_to_primary
+from pagination import encode_cursor, decode_cursor
+
+# The cache and its invalidation are per process: another worker keeps serving its own copy until
+# it expires, so ROSTER_CACHE_SECONDS bounds how stale a page can be there
+_cache = OrderedDict()
+# Bumped by every invalidation, per org and under None for all orgs
+_generations = {}
+_cache_lock = threading.Lock()
+
+def _placeholders(ids):
+    return ', '.join(['%s'] * len(ids))
+
+def _load_members(org_id, limit, cursor):
+    conditions = ["org_id = %s"]
+    params = [org_id]
+    if cursor:
+        created_at, last_id = decode_cursor(cursor)
+        conditions.append("(created_at < %s OR (created_at = %s AND id < %s))")
+        params.extend([created_at, created_at, last_id])
+    params.append(limit + 1)
+    query = f"""
+        SELECT id, name, email, phone, department, created_at
+        FROM org_users
+        WHERE {' AND '.join(conditions)}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+    """
+    return execute_query(query, params)
+
+def _latest_measurements(member_ids):
+    # One row per (user, type): the newest measurement, picked by the window over the user_id index
+    query = f"""
+        SELECT id, user_id, measurement_type_id, type_name, current_version, updated_at
+        FROM (
+            SELECT m.id, m.user_id, m.measurement_type_id, mt.name AS type_name, m.current_version, m.updated_at,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY m.user_id, m.measurement_type_id ORDER BY m.updated_at DESC, m.id DESC
+                   ) AS position
+            FROM measurements m
+            JOIN measurement_types mt ON m.measurement_type_id = mt.id
+            WHERE m.user_type = 'org_user' AND m.user_id IN ({_placeholders(member_ids)})
+        ) latest
+        WHERE position = 1
+    """
+    by_member = {}
+    for row in execute_query(query, member_ids):
+        by_member.setdefault(row['user_id'], []).append({
+            'id': row['id'],
+            'type_id': row['measurement_type_id'],
+            'type_name': row['type_name'],
+            'version': row['current_version'],
+            'updated_at': row['updated_at']
+        })
+    return by_member
+
+def _latest_orders(org_id, member_ids):
+    # Orders for an org user are placed either as them or on their behalf (org_user_id)
+    query = f"""
+        SELECT id, member_id, status, total_amount, created_at
+        FROM (
+            SELECT id, COALESCE(org_user_id, user_id) AS member_id, status, total_amount, created_at,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY COALESCE(org_user_id, user_id) ORDER BY created_at DESC, id DESC
+                   ) AS position
+            FROM orders
+            WHERE org_id = %s
+              AND (user_id IN ({_placeholders(member_ids)}) OR org_user_id IN ({_placeholders(member_ids)}))
+        ) latest
+        WHERE position = 1
+    """
+    rows = execute_query(query, [org_id] + member_ids + member_ids)
+    return {
+        row['member_id']: {
+            'id': row['id'],
+            'status': row['status'],
+            'total_amount': row['total_amount'],
+            'created_at': row['created_at']
+        }
+        for row in rows
+    }
+
+def build_roster(org_id, limit, cursor=None):
+    members = _load_members(org_id, limit, cursor)
+    next_cursor = None
+    if len(members) > limit:
+        members = members[:limit]
+        next_cursor = encode_cursor(members[-1]['created_at'], members[-1]['id'])
+
+    member_ids = [member['id'] for member in members]
+    measurements = _latest_measurements(member_ids) if member_ids else {}
+    orders = _latest_orders(org_id, member_ids) if member_ids else {}
+    for member in members:
+        member['latest_measurements'] = measurements.get(member['id'], [])
+        member['latest_order'] = orders.get(member['id'])
+    return {'members': members, 'next_cursor': next_cursor}
+
+def get_roster(org_id, limit, cursor=None):
+    # Pages are cached per org for ROSTER_CACHE_SECONDS, so an admin screen polling the roster
+    # costs three queries per page at most that often
+    key = (org_id, limit, cursor)
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[0] > now:
+            _cache.move_to_end(key)
+            return cached[1]
+        generation = (_generations.get(None, 0), _generations.get(org_id, 0))
+
+    # A lagging replica could return the very state an invalidation just replaced
+    pin_to_primary()
+    roster = build_roster(org_id, limit, cursor)
+    with _cache_lock:
+        # Invalidated while building: the page may already be out of date, so it is served but not kept
+        if (_generations.get(None, 0), _generations.get(org_id, 0)) != generation:
+            return roster
+        _cache[key] = (now + Config.ROSTER_CACHE_SECONDS, roster)
+        _cache.move_to_end(key)
+        while len(_cache) > Config.ROSTER_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return roster
+
+def invalidate_roster(org_id=None):
+    # Without an org every cached page goes
+    with _cache_lock:
+        _generations[org_id] = _generations.get(org_id, 0) + 1
+        if org_id is None:
+            _cache.clear()
+            return
+        for key in [key for key in _cache if key[0] == org_id]:
+            del _cache[key]
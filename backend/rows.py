@@ -0,0 +1,82 @@
+import json
+from flask import Response, current_app
+
+CHUNK_SIZE = 1000
+LAYOUTS = ('objects', 'columns')
+
+def parse_layout(value):
+    if not value:
+        return 'objects'
+    if value not in LAYOUTS:
+        raise ValueError(f"Layout must be one of: {', '.join(LAYOUTS)}")
+    return value
+
+_record_classes = {}
+
+def record_class(columns):
+    # One __slots__ class per column layout, so records carry no per-instance dict
+    columns = tuple(columns)
+    cls = _record_classes.get(columns)
+    if cls is None:
+        if len(set(columns)) != len(columns):
+            raise ValueError(f"Duplicate column names: {', '.join(columns)}")
+
+        def __init__(self, row):
+            for name, value in zip(columns, row):
+                setattr(self, name, value)
+
+        def as_dict(self):
+            return {name: getattr(self, name) for name in columns}
+
+        cls = type('Record', (), {'__slots__': columns, '__init__': __init__, 'as_dict': as_dict})
+        _record_classes[columns] = cls
+    return cls
+
+# A result set kept as the driver's tuples plus a single column list
+class Rows:
+    __slots__ = ('columns', 'rows')
+
+    def __init__(self, columns, rows):
+        self.columns = list(columns)
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def records(self):
+        cls = record_class(self.columns)
+        return (cls(row) for row in self.rows)
+
+    def column(self, name):
+        index = self.columns.index(name)
+        return [row[index] for row in self.rows]
+
+    def iter_json(self, key, layout='objects', **extra):
+        # Encodes CHUNK_SIZE rows at a time, so at most one chunk of row objects exists at once.
+        # layout='columns' sends {"columns": [...], "rows": [[...], ...]} straight from the tuples.
+        encoder = json.JSONEncoder(default=current_app.json.default, ensure_ascii=current_app.json.ensure_ascii)
+        columns = self.columns
+        rows = self.rows
+
+        def generate():
+            head = encoder.encode(extra)[:-1]
+            yield f'{head}, "{key}": ' if extra else f'{{"{key}": '
+            if layout == 'columns':
+                yield f'{{"columns": {encoder.encode(columns)}, "rows": ['
+            else:
+                yield '['
+            for start in range(0, len(rows), CHUNK_SIZE):
+                chunk = rows[start:start + CHUNK_SIZE]
+                if layout != 'columns':
+                    chunk = [dict(zip(columns, row)) for row in chunk]
+                body = encoder.encode(chunk)[1:-1]
+                yield body if start == 0 else ', ' + body
+            yield ']}}' if layout == 'columns' else ']}'
+
+        return generate()
+
+    def json_response(self, key, layout='objects', **extra):
+        return Response(self.iter_json(key, layout, **extra), mimetype='application/json')
@@ -0,0 +1,128 @@
+import sys
+import numpy as np
+from db import get_connection, execute_query
+from analytics import latest_measurement_values
+import jobs
+
+# Users are scored in chunks so the (users x sizes x fields) difference array stays small
+CHUNK_SIZE = 2000
+
+def nearest_sizes(user_values, size_values, size_weights):
+    # user_values is (users x fields) and size_values/size_weights are (sizes x fields); NaN marks a missing value
+    size_weights = np.where(np.isnan(size_values), 0.0, size_weights)
+    best = np.empty(len(user_values), dtype=np.int64)
+    distances = np.empty(len(user_values), dtype=np.float64)
+    for start in range(0, len(user_values), CHUNK_SIZE):
+        chunk = user_values[start:start + CHUNK_SIZE]
+        diff = chunk[:, None, :] - size_values[None, :, :]
+        present = ~np.isnan(diff)
+        weights = size_weights[None, :, :] * present
+        squared = np.where(present, diff * diff, 0.0)
+        numerator = (weights * squared).sum(axis=2)
+        denominator = weights.sum(axis=2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = np.where(denominator > 0, np.sqrt(numerator / denominator), np.inf)
+        best[start:start + CHUNK_SIZE] = scores.argmin(axis=1)
+        distances[start:start + CHUNK_SIZE] = scores.min(axis=1)
+    return best, distances
+
+def get_size_chart(product_id):
+    query = """
+        SELECT ps.id, ps.label, ps.measurement_type_id, psv.field_id, psv.value_numeric, psv.weight
+        FROM product_sizes ps
+        LEFT JOIN product_size_values psv ON psv.size_id = ps.id
+        WHERE ps.product_id = %s
+        ORDER BY ps.display_order, ps.id
+    """
+    return execute_query(query, (product_id,))
+
+def compute_recommendations(product_id, org_id):
+    chart = get_size_chart(product_id)
+    if not chart:
+        return []
+    type_id = chart[0]['measurement_type_id']
+
+    rows = latest_measurement_values(org_id, type_id)
+    if not rows:
+        return []
+
+    size_ids = list(dict.fromkeys(row['id'] for row in chart))
+    size_labels = {row['id']: row['label'] for row in chart}
+    field_ids = sorted({row['field_id'] for row in chart if row['field_id']})
+    field_index = {field_id: i for i, field_id in enumerate(field_ids)}
+    size_index = {size_id: i for i, size_id in enumerate(size_ids)}
+
+    size_values = np.full((len(size_ids), len(field_ids)), np.nan)
+    size_weights = np.zeros((len(size_ids), len(field_ids)))
+    for row in chart:
+        if row['field_id']:
+            size_values[size_index[row['id']], field_index[row['field_id']]] = float(row['value_numeric'])
+            size_weights[size_index[row['id']], field_index[row['field_id']]] = float(row['weight'])
+
+    users = {}
+    for row in rows:
+        users.setdefault(row['user_id'], row['measurement_id'])
+    user_ids = list(users)
+    user_index = {user_id: i for i, user_id in enumerate(user_ids)}
+
+    user_values = np.full((len(user_ids), len(field_ids)), np.nan)
+    for row in rows:
+        if row['field_id'] in field_index:
+            user_values[user_index[row['user_id']], field_index[row['field_id']]] = float(row['value_numeric'])
+
+    best, distances = nearest_sizes(user_values, size_values, size_weights)
+
+    recommendations = []
+    for i, user_id in enumerate(user_ids):
+        if np.isinf(distances[i]):
+            continue
+        size_id = size_ids[best[i]]
+        recommendations.append({
+            'user_id': user_id,
+            'measurement_id': users[user_id],
+            'size_id': size_id,
+            'size_label': size_labels[size_id],
+            'distance': round(float(distances[i]), 3)
+        })
+    return recommendations
+
+def save_recommendations(product_id, org_id, recommendations):
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            # Clears this org's stale rows; a user whose row was written under another org before they
+            # moved shares the (product_id, user_id) key, so the insert overwrites it instead of colliding
+            cursor.execute(
+                "DELETE FROM size_recommendations WHERE org_id = %s AND product_id = %s", (org_id, product_id)
+            )
+            if recommendations:
+                cursor.executemany("""
+                    INSERT INTO size_recommendations
+                        (product_id, user_id, org_id, size_id, size_label, measurement_id, distance)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE org_id = VALUES(org_id), size_id = VALUES(size_id),
+                        size_label = VALUES(size_label), measurement_id = VALUES(measurement_id),
+                        distance = VALUES(distance)
+                """, [
+                    (product_id, r['user_id'], org_id, r['size_id'], r['size_label'], r['measurement_id'], r['distance'])
+                    for r in recommendations
+                ])
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def run_size_recommendations(product_id, org_id):
+    recommendations = compute_recommendations(product_id, org_id)
+    save_recommendations(product_id, org_id, recommendations)
+    return recommendations
+
+@jobs.register('size_recommendations')
+def size_recommendations_job(job_id, payload):
+    recommendations = run_size_recommendations(payload['product_id'], payload['org_id'])
+    return {'count': len(recommendations)}
+
+if __name__ == '__main__':
+    run_size_recommendations(sys.argv[1], sys.argv[2])
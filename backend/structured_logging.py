@@ -0,0 +1,85 @@
+import atexit
+import json
+import logging
+import multiprocessing
+import os
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from config import Config
+
+_STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_queue = None
+_listener = None
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+        }
+        # Anything passed through extra= becomes a top-level field
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS:
+                entry[key] = value
+        return json.dumps(entry, default=str)
+
+# Rolls over when the file reaches max_bytes or at midnight, whichever comes first
+class SizeAndDailyRotatingFileHandler(RotatingFileHandler):
+    def __init__(self, filename, max_bytes, backup_count):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.rollover_at = self._next_midnight()
+
+    @staticmethod
+    def _next_midnight():
+        now = time.localtime()
+        return time.mktime((now.tm_year, now.tm_mon, now.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+
+    def shouldRollover(self, record):
+        if time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = self._next_midnight()
+
+def _attach(log_queue, level):
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    # The message and any traceback are rendered here; extra= fields travel with the record
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level)
+
+def setup_logging(level=logging.INFO):
+    global _queue, _listener
+    if _listener is not None:
+        return _queue
+    os.makedirs(os.path.dirname(Config.LOG_FILE), exist_ok=True)
+    file_handler = SizeAndDailyRotatingFileHandler(Config.LOG_FILE, Config.LOG_MAX_BYTES, Config.LOG_BACKUP_COUNT)
+    file_handler.setFormatter(JsonFormatter())
+    # A process-safe queue so job worker processes log through the same single writer
+    _queue = multiprocessing.Queue(-1)
+    _listener = QueueListener(_queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    _attach(_queue, level)
+    return _queue
+
+def init_worker_logging(log_queue, level=logging.INFO):
+    if log_queue is not None:
+        _attach(log_queue, level)
+
+def get_log_queue():
+    return _queue
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,48 @@
+from datetime import datetime
+from config import Config
+from db import execute_query, pin_to_primary
+
+def parse_since(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('T', ' ').rstrip('Z'))
+    except ValueError:
+        raise ValueError('Invalid since timestamp')
+
+def current_sync_cursor(since=None):
+    # Taken from the database clock before reading, so rows written during the read are re-sent next time.
+    # A delta read must not miss rows a lagging replica has yet to apply, so it is pinned to the primary.
+    # A full read may use a replica; its cursor is moved back by the most a replica may lag, so the
+    # first delta re-sends anything the replica had not applied yet.
+    if since:
+        pin_to_primary()
+        result = execute_query("SELECT CURRENT_TIMESTAMP AS now")
+    else:
+        result = execute_query(
+            "SELECT CURRENT_TIMESTAMP - INTERVAL %s SECOND AS now", (Config.READ_YOUR_WRITES_SECONDS,)
+        )
+    return result[0]['now'].strftime('%Y-%m-%d %H:%M:%S')
+
+# Sync contract: a row leaves a tombstone only when the app deletes it through a route or job that calls
+# record_tombstone (or deletion.py, which writes them per chunk). Rows removed by a foreign-key cascade,
+# e.g. products under a product_categories row deleted outside the API, or measurements under a deleted
+# measurement type, get none; any such delete must tombstone the children first or clients must re-sync fully.
+def record_tombstone(table_name, record_id, org_id=None, user_id=None):
+    query = """
+        INSERT INTO deleted_records (table_name, record_id, org_id, user_id)
+        VALUES (%s, %s, %s, %s)
+    """
+    execute_query(query, (table_name, record_id, org_id, user_id), fetch=False)
+
+def get_tombstones(table_name, since, org_id=None, user_id=None):
+    conditions = ["table_name = %s", "deleted_at >= %s"]
+    params = [table_name, since]
+    if org_id is not None:
+        conditions.append("org_id = %s")
+        params.append(org_id)
+    if user_id is not None:
+        conditions.append("user_id = %s")
+        params.append(user_id)
+    query = f"SELECT DISTINCT record_id FROM deleted_records WHERE {' AND '.join(conditions)}"
+    return [row['record_id'] for row in execute_query(query, params)]
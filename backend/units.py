@@ -0,0 +1,78 @@
+import re
+import sys
+from decimal import Decimal, InvalidOperation
+from db import get_connection, execute_query
+
+# Numeric measurement values are stored in centimetres
+UNIT_FACTORS = {
+    'cm': Decimal('1'),
+    'cms': Decimal('1'),
+    'centimeter': Decimal('1'),
+    'centimeters': Decimal('1'),
+    'mm': Decimal('0.1'),
+    'm': Decimal('100'),
+    'in': Decimal('2.54'),
+    'inch': Decimal('2.54'),
+    'inches': Decimal('2.54'),
+    '"': Decimal('2.54'),
+    'ft': Decimal('30.48'),
+    'feet': Decimal('30.48'),
+}
+
+VALUE_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)(?:\s+(\d+)/(\d+))?\s*([a-zA-Z"]*)\s*$')
+
+def parse_measurement(value, unit=None):
+    match = VALUE_PATTERN.match(str(value))
+    if not match:
+        return None
+    number, numerator, denominator, suffix = match.groups()
+    try:
+        amount = Decimal(number)
+        if numerator and int(denominator):
+            amount += Decimal(numerator) / Decimal(denominator)
+    except InvalidOperation:
+        return None
+    factor = UNIT_FACTORS.get((suffix or unit or 'cm').strip().lower())
+    if factor is None:
+        return None
+    return (amount * factor).quantize(Decimal('0.001'))
+
+def load_field_units(field_ids):
+    field_ids = list(set(field_ids))
+    if not field_ids:
+        return {}
+    placeholders = ', '.join(['%s'] * len(field_ids))
+    query = f"SELECT id, unit FROM measurement_fields WHERE id IN ({placeholders})"
+    return {row['id']: row['unit'] for row in execute_query(query, field_ids)}
+
+def backfill_numeric_values(batch_size=1000):
+    conn = get_connection()
+    try:
+        last_id = ''
+        while True:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT mv.id, mv.value, mf.unit
+                    FROM measurement_values mv
+                    JOIN measurement_fields mf ON mv.field_id = mf.id
+                    WHERE mv.value_numeric IS NULL AND mv.id > %s
+                    ORDER BY mv.id
+                    LIMIT %s
+                """, (last_id, batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                updates = [
+                    (parse_measurement(row['value'], row['unit']), row['id']) for row in rows
+                ]
+                cursor.executemany(
+                    "UPDATE measurement_values SET value_numeric = %s WHERE id = %s",
+                    [update for update in updates if update[0] is not None]
+                )
+                conn.commit()
+                last_id = rows[-1]['id']
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    backfill_numeric_values(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)